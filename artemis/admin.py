@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseInlineFormSet
 from .models import *
 
 class SiteAdmin(admin.ModelAdmin):
@@ -39,6 +41,45 @@ class CyVerseAccountAdmin(admin.ModelAdmin):
         'user', 
     )
 
+class DepthBinFormSet(BaseInlineFormSet):
+    """
+    Checks the submitted bins of a scheme against each other, so bins can be
+    moved or replaced in one save.
+    """
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        form.instance.check_saved_overlaps = False
+        return form
+
+    def clean(self):
+        super().clean()
+
+        bins = sorted(
+            (form.cleaned_data['kind'], form.cleaned_data['min_depth'], form.cleaned_data['max_depth'])
+            for form in self.forms
+            if form.cleaned_data and not form.errors and not self._should_delete_form(form)
+        )
+
+        # with bins sorted by kind & min depth, any overlap shows between neighbours
+        for (kind, min_depth, max_depth), (next_kind, next_min_depth, next_max_depth) in zip(bins, bins[1:]):
+            if kind == next_kind and next_min_depth < max_depth:
+                raise ValidationError('The {}-{} and {}-{} bins overlap.'.format(
+                    min_depth, max_depth, next_min_depth, next_max_depth
+                ))
+
+class DepthBinInline(admin.TabularInline):
+    model = DepthBin
+    formset = DepthBinFormSet
+
+class DepthSchemeAdmin(admin.ModelAdmin):
+    list_display = (
+        'name', 'site',
+    )
+    inlines = [
+        DepthBinInline,
+    ]
+
 
 admin.site.register(Site, SiteAdmin)
 admin.site.register(Plot, PlotAdmin)
@@ -47,3 +88,4 @@ admin.site.register(Mineralogy, MineralogyAdmin)
 admin.site.register(Geochemistry, GeochemistryAdmin)
 admin.site.register(Extraction, ExtractionAdmin)
 admin.site.register(CyVerseAccount, CyVerseAccountAdmin)
+admin.site.register(DepthScheme, DepthSchemeAdmin)
@@ -1,18 +1,22 @@
 import json
+import math
 import requests
 import time
 import os
 from urllib.parse import urlencode, quote
 
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.db.models import Avg
-from django.core.cache import cache 
 
 from django.contrib.auth.models import User
 from django.shortcuts import render
+from artemis.api.http import SiteJsonResponse, cached_json_response
+from artemis.cache import get_site_json, get_site_version, set_site_data
+from artemis.export import EXPORTERS, EXPORT_FORMATS
 from artemis.models import (
+  DepthSummary,
   Site,
   Geochemistry,
   Plot,
@@ -21,76 +25,25 @@ from artemis.models import (
   Mineralogy,
   Extraction
 )
+from artemis.depth_schemes import depth_label_key, get_depth_scheme
+from artemis.geochemistry_values import load_site_samples, values_enabled
+from artemis.spatial import bbox_filter, within_radius
+from artemis.summaries import (
+  DATASETS,
+  SiteSummaries,
+  elements,
+  extraction_elements,
+  minerals,
+  solvents,
+)
 
-from rest_framework import serializers, viewsets, generics, views
+from django_filters import rest_framework as filters
+from rest_framework import pagination, serializers, viewsets, generics, views
+from rest_framework.exceptions import ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response import Response
 
 
-elements = [
-    'Ag',
-    'Al',
-    'As',
-    'Au',
-    'Ba',
-    'Be',
-    'Bi',
-    'Br',
-    'Ca',
-    'Cd',
-    'Ce',
-    'Co',
-    'Cr',
-    'Cs',
-    'Cu',
-    'Dy',
-    'Er',
-    'Eu',
-    'Fe',
-    'Ga',
-    'Gd',
-    'Ge',
-    'Hf',
-    'Ho',
-    'In',
-    'Ir',
-    'K',
-    'La',
-    'Lu',
-    'Mg',
-    'Mn',
-    'Mo',
-    'Na',
-    'Nb',
-    'Nd',
-    'Ni',
-    'P',
-    'Pb',
-    'Pr',
-    'Rb',
-    'S',
-    'Sb',
-    'Sc',
-    'Se',
-    'Si',
-    'Sm',
-    'Sn',
-    'Sr',
-    'Ta',
-    'Tb',
-    'Th',
-    'Ti',
-    'Tl',
-    'Tm',
-    'U',
-    'V',
-    'W',
-    'Y',
-    'Yb',
-    'Zn',
-    'Zr',
-]
-
-
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -117,9 +70,71 @@ class SiteSerializer(serializers.ModelSerializer):
         model = Site
         fields = ['id', 'name', 'latitude', 'longitude']
 
+class SpatialFilter(filters.FilterSet):
+    """
+    Location filters, backed by the grid index of artemis.spatial:
+
+    - `?bbox=west,south,east,north` for rows within a box, in degrees,
+    - `?near=latitude,longitude&radius=km` for rows within a radius,
+      nearest first.
+    """
+
+    bbox = filters.CharFilter(method='filter_bbox')
+    near = filters.CharFilter(method='filter_near')
+    radius = filters.NumberFilter(method='filter_radius')
+
+    def parse_coordinates(self, name, value, count):
+
+        try:
+            coordinates = [float(coordinate) for coordinate in value.split(',')]
+        except ValueError:
+            coordinates = []
+
+        if len(coordinates) != count or not all(math.isfinite(coordinate) for coordinate in coordinates):
+            raise ValidationError({name: 'Must be {} comma-separated numbers.'.format(count)})
+
+        return coordinates
+
+    def filter_bbox(self, queryset, name, value):
+
+        west, south, east, north = self.parse_coordinates(name, value, 4)
+        if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south <= north <= 90):
+            raise ValidationError({name: 'Must be west,south,east,north in degrees.'})
+
+        return queryset.filter(bbox_filter(west, south, east, north))
+
+    def filter_near(self, queryset, name, value):
+
+        latitude, longitude = self.parse_coordinates(name, value, 2)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValidationError({name: 'Must be latitude,longitude in degrees.'})
+
+        radius = self.form.cleaned_data.get('radius')
+        if radius is None or radius <= 0:
+            raise ValidationError({'radius': 'A positive radius in km is required with near.'})
+
+        return within_radius(queryset, latitude, longitude, float(radius))
+
+    def filter_radius(self, queryset, name, value):
+        # applied by filter_near
+        return queryset
+
+
+class SiteFilter(SpatialFilter):
+    class Meta:
+        model = Site
+        fields = []
+
+
 class SiteViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Sites, filterable by location (see `SpatialFilter`).
+    """
+
     queryset = Site.objects.all()
     serializer_class = SiteSerializer
+    filter_backends = [filters.DjangoFilterBackend]
+    filterset_class = SiteFilter
 
 
 class PlotSerializer(serializers.ModelSerializer):
@@ -135,11 +150,24 @@ class PlotViewSet(viewsets.ReadOnlyModelViewSet):
 class ReplicateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Replicate
-        fields = '__all__'
+        exclude = ['grid_cell']
+
+
+class ReplicateFilter(SpatialFilter):
+    class Meta:
+        model = Replicate
+        fields = []
+
 
 class ReplicateViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Replicates, filterable by location (see `SpatialFilter`).
+    """
+
     queryset = Replicate.objects.all()
     serializer_class = ReplicateSerializer
+    filter_backends = [filters.DjangoFilterBackend]
+    filterset_class = ReplicateFilter
 
 
 class GeochemistrySerializer(serializers.ModelSerializer):
@@ -147,31 +175,108 @@ class GeochemistrySerializer(serializers.ModelSerializer):
         model = Geochemistry
         fields = '__all__'
 
+    def __init__(self, *args, **kwargs):
+        # optional subset of fields to serialize
+        fields = kwargs.pop('fields', None)
+
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class GeochemistryFilter(filters.FilterSet):
+    class Meta:
+        model = Geochemistry
+        fields = {
+            'site': ['exact', 'in'],
+            'replicate': ['exact', 'in', 'isnull'],
+            'time_label': ['exact', 'in'],
+            'min_depth': ['exact', 'gte', 'lte'],
+            'max_depth': ['exact', 'gte', 'lte'],
+        }
+
+
+class GeochemistryPagination(pagination.CursorPagination):
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
 class GeochemistryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Geochemistry measurements, paginated by cursor.
+
+    Supports filtering by site, replicate, time_label and depth range
+    (e.g. `?site=1&min_depth__gte=20&max_depth__lte=60`) and a sparse
+    fieldset (e.g. `?fields=Fe,Cu,pH`).
+    """
+
     queryset = Geochemistry.objects.all()
     serializer_class = GeochemistrySerializer
+    filter_backends = [filters.DjangoFilterBackend]
+    filterset_class = GeochemistryFilter
+    pagination_class = GeochemistryPagination
+
+    def get_fields(self):
+        """
+        Returns the fields requested with `?fields=`, or None for all fields.
+        """
+
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+
+        field_names = set(field.name for field in Geochemistry._meta.concrete_fields)
+        unknown = [field for field in fields if field not in field_names]
+        if unknown:
+            raise ValidationError({'fields': 'Unknown fields: {}'.format(', '.join(unknown))})
+
+        # the id is always needed to page through the results
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+
+        return fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        fields = self.get_fields()
+        if fields is not None:
+            queryset = queryset.only(*fields)
+
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_fields())
+
+        return super().get_serializer(*args, **kwargs)
 
 class SiteGeochemistryCached(views.APIView):
 
     def get(self, request, *args, **kwargs):
 
-        json_data = cache.get('site-geochem')
-        return JsonResponse(json_data, safe=False)
+        content = get_site_json('geochemistry', kwargs['site_id'], SiteGeochemistry().get_site_data)
+        return cached_json_response(request, content)
 
 class SiteMineralogyCached(views.APIView):
 
     def get(self, request, *args, **kwargs):
 
-        json_data = cache.get('site-mineralogy')
-        return JsonResponse(json_data, safe=False)
+        content = get_site_json('mineralogy', kwargs['site_id'], SiteMineralogy().get_site_data)
+        return cached_json_response(request, content)
 
 
 class SiteExtractionsCached(views.APIView):
 
     def get(self, request, *args, **kwargs):
 
-        json_data = cache.get('site-extractions')
-        return JsonResponse(json_data, safe=False)
+        content = get_site_json('extractions', kwargs['site_id'], SiteExtractions().get_site_data)
+        return cached_json_response(request, content)
 
 
 class SiteReplicates(generics.ListAPIView):
@@ -186,34 +291,177 @@ class SiteReplicates(generics.ListAPIView):
         return queryset
 
 
+class SiteJsonContentNegotiation(BaseContentNegotiation):
+    """
+    The site views build their JSON response by hand, so DRF's renderer is never
+    used. Skipping renderer negotiation leaves the `format` query param free
+    for the views themselves.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
 class SiteGeochemPoints(views.APIView):
+    """
+    Gets every site geochemistry measurement as one point per sample and element.
+
+    `?format=columnar` returns parallel arrays instead of a list of points, and
+    `?elements=Fe,As` limits the points to some elements. Payloads of every
+    element are served from the site cache.
+    """
+
+    content_negotiation_class = SiteJsonContentNegotiation
 
     def get(self, request, *args, **kwargs):
 
         site_id = kwargs['site_id']
-        site_geochem = Geochemistry.objects.filter(site=site_id)
+        columnar = request.query_params.get('format') == 'columnar'
+        point_elements = self.get_elements(request.query_params.get('elements'))
+
+        if point_elements is not None:
+            # element subsets aren't cached
+            build = self.build_columnar_site_data if columnar else self.build_site_data
+            return SiteJsonResponse(build(self.get_site_rows(site_id, point_elements), point_elements))
+
+        if columnar:
+            content = get_site_json('geochem-points-columnar', site_id, self.get_columnar_site_data)
+        else:
+            content = get_site_json('geochem-points', site_id, self.get_site_data)
+
+        return cached_json_response(request, content)
+
+    sample_fields = [
+        'min_depth',
+        'max_depth',
+        'time_label',
+        'replicate_id',
+        'replicate__plot__treatment__label',
+    ]
+
+    @staticmethod
+    def get_elements(value):
+        """
+        Returns the elements requested with `?elements=`, in the usual order,
+        or None for every element.
+        """
+
+        if not value:
+            return None
+
+        requested = [element.strip() for element in value.split(',') if element.strip()]
+        unknown = [element for element in requested if element not in elements]
+        if unknown:
+            raise ValidationError({'elements': 'Unknown elements: {}'.format(', '.join(unknown))})
+
+        return [element for element in elements if element in requested]
+
+    def get_site_rows(self, site_id, point_elements=None):
+
+        if point_elements is not None and values_enabled():
+            # a few element values from the long-format table
+            return load_site_samples(site_id, self.sample_fields, point_elements)
+
+        # fetch the replicate & treatment joins with the measurements
+        return list(Geochemistry.objects.filter(site=site_id).values(*self.sample_fields, *(point_elements or elements)))
+
+    def get_site_data(self, site_id):
+
+        return self.build_site_data(self.get_site_rows(site_id))
+
+    def build_site_data(self, rows, point_elements=elements):
 
         points = []
 
-        for geochem in site_geochem:
+        for geochem in rows:
 
-            for element in elements:
+            for element in point_elements:
                 point = {}
                 point['element'] = element,
-                point['element_amount'] = getattr(geochem, element)
-                point['depth'] =  str(geochem.min_depth) + '-' + str(geochem.max_depth),
-                point['time'] = geochem.time_label
-                point['treatment'] = geochem.replicate.plot.treatment.label if geochem.replicate else None
-                point['replicate'] = geochem.replicate.id if geochem.replicate else None
+                point['element_amount'] = geochem[element]
+                point['depth'] =  str(geochem['min_depth']) + '-' + str(geochem['max_depth']),
+                point['time'] = geochem['time_label']
+                point['treatment'] = geochem['replicate__plot__treatment__label']
+                point['replicate'] = geochem['replicate_id']
                 points.append(point)
         
         response = {
             'points': points
         }
 
-        cache.set('site-geochem-points', response)
+        return response
+
+    def get_columnar_site_data(self, site_id):
+
+        return self.build_columnar_site_data(self.get_site_rows(site_id))
+
+    def build_columnar_site_data(self, rows, point_elements=elements):
+
+        columns = {
+            'element': [],
+            'element_amount': [],
+            'depth': [],
+            'time': [],
+            'treatment': [],
+            'replicate': [],
+        }
+        element_count = len(point_elements)
+
+        for geochem in rows:
+            depth = '{}-{}'.format(geochem['min_depth'], geochem['max_depth'])
+
+            columns['element'].extend(point_elements)
+            columns['element_amount'].extend([geochem[element] for element in point_elements])
+            columns['depth'].extend([depth] * element_count)
+            columns['time'].extend([geochem['time_label']] * element_count)
+            columns['treatment'].extend([geochem['replicate__plot__treatment__label']] * element_count)
+            columns['replicate'].extend([geochem['replicate_id']] * element_count)
+
+        response = {
+            'points': columns
+        }
+
+        return response
+
+def get_site_treatments(site_id):
+    """
+    Returns the treatment ids of a site's plots, and their descriptions by id.
+    """
+
+    plots = Plot.objects.filter(site_id=site_id)
+    treatment_ids = list(plots.values_list('treatment', flat=True).distinct())
+    treatment_names = dict(
+        Treatment.objects.filter(id__in=treatment_ids).values_list('id', 'description')
+    )
+
+    return treatment_ids, treatment_names
+
+
+class SiteHierarchy:
+    """
+    A site's plots, treatments and replicates, loaded once for building
+    several payloads.
+    """
+
+    def __init__(self, site_id):
+        plots = list(Plot.objects.filter(site_id=site_id).select_related('treatment'))
+        self.replicates = list(Replicate.objects.filter(plot__site_id=site_id))
+
+        # same as get_site_treatments
+        treatment_ids = []
+        treatment_names = {}
+        for plot in plots:
+            if plot.treatment_id not in treatment_names:
+                treatment_ids.append(plot.treatment_id)
+                treatment_names[plot.treatment_id] = plot.treatment.description
+
+        self.treatments = (treatment_ids, treatment_names)
+
+        plot_treatments = {plot.id: plot.treatment.label for plot in plots}
+        self.replicate_treatments = {
+            replicate.id: plot_treatments[replicate.plot_id] for replicate in self.replicates
+        }
 
-        return JsonResponse(response, safe=False)
 
 class SiteGeochemistry(views.APIView):
     """
@@ -225,152 +473,55 @@ class SiteGeochemistry(views.APIView):
 
     def get(self, request, *args, **kwargs):
 
-        elements = [
-            'Ag',
-            'Al',
-            'As',
-            'Au',
-            'Ba',
-            'Be',
-            'Bi',
-            'Br',
-            'Ca',
-            'Cd',
-            'Ce',
-            'Co',
-            'Cr',
-            'Cs',
-            'Cu',
-            'Dy',
-            'Er',
-            'Eu',
-            'Fe',
-            'Ga',
-            'Gd',
-            'Ge',
-            'Hf',
-            'Ho',
-            'In',
-            'Ir',
-            'K',
-            'La',
-            'Lu',
-            'Mg',
-            'Mn',
-            'Mo',
-            'Na',
-            'Nb',
-            'Nd',
-            'Ni',
-            'P',
-            'Pb',
-            'Pr',
-            'Rb',
-            'S',
-            'Sb',
-            'Sc',
-            'Se',
-            'Si',
-            'Sm',
-            'Sn',
-            'Sr',
-            'Ta',
-            'Tb',
-            'Th',
-            'Ti',
-            'Tl',
-            'Tm',
-            'U',
-            'V',
-            'W',
-            'Y',
-            'Yb',
-            'Zn',
-            'Zr',
-        ]
+        site_id = kwargs['site_id']
+        version = get_site_version(site_id)
+        response = self.get_site_data(site_id)
+        set_site_data('geochemistry', site_id, response, version)
 
-        depths_time0 = [
-            [0, 5],
-            [5, 15],
-            [15, 25], 
-            [25, 35],
-            [35, 38],
-            [38, 54],
-            [180, 183],
-        ]
+        return SiteJsonResponse(response)
 
-        depths = [
-            [0, 20],
-            [20, 40], 
-            [40, 60],
-            [60, 90]
-        ]
+    def get_site_data(self, site_id):
 
-        depths_mapping = {
-            '0-20': [[0, 5], [5, 15], [15, 25]],
-            '20-40': [[25, 35], [35, 38]],
-            '40-60': [[38, 54]],
-            '60-90': [],
-        }
+        return self.build_site_data(
+            SiteSummaries(site_id, 'geochemistry'),
+            get_site_treatments(site_id),
+            get_depth_scheme(site_id),
+        )
 
+    def build_site_data(self, summaries, treatments, scheme):
 
-        site_id = kwargs['site_id']
-        site_geochem = Geochemistry.objects.filter(site=site_id)
-        
+        treatment_ids, treatment_names = treatments
         response = {}
-        time_labels = list(site_geochem.values_list('time_label', flat=True).distinct())
 
-        # get plots, replicates & treatments for this site
-        replicate_ids = site_geochem.exclude(replicate=None).values_list('replicate', flat=True).distinct()
-        replicates = Replicate.objects.filter(id__in=replicate_ids)
-        plots = Plot.objects.filter(site_id=site_id)
-        treatment_ids = plots.values_list('treatment', flat=True).distinct()
-        
-        for time in time_labels:
+        for time in summaries.time_labels:
             response[time] = {}
 
             for treatment_id in treatment_ids:
-                treatment_name = Treatment.objects.get(id=treatment_id).description
+                treatment_name = treatment_names[treatment_id]
                 response[time][treatment_name] = {}
                 response[time]['raw'] = {}
-                treatment_replicates = replicates.filter(plot__treatment=treatment_id)
-                treatment_geochem = site_geochem.filter(time_label=time, replicate__in=treatment_replicates)
 
                 for element in elements:
                     response[time][treatment_name][element] = {}
 
                     if time == 0:
                         response[time]['raw'][element] = {}
-                        for depth in depths_time0:
-                            min_depth = depth[0]
-                            max_depth = depth[1]
-                            depth_str = '{}-{}'.format(min_depth, max_depth)
-                            depth_geochem = site_geochem.get(min_depth=min_depth, time_label=0)
-                            response[time]['raw'][element][depth_str] = getattr(depth_geochem, element)
+                        for depth_str in scheme.time0.labels:
+                            response[time]['raw'][element][depth_str] = summaries.raw(element, depth_str)
                 
-                    for depth in depths:
-                        min_depth = depth[0]
-                        max_depth = depth[1]
-                        depth_str = '{}-{}'.format(min_depth, max_depth)
-
+                    for depth_str in scheme.later.labels:
                         if time == 0:
-                            approx_depths = depths_mapping[depth_str]
-                            approx_mins = [item[0] for item in approx_depths]
-                            depth_geochem = site_geochem.filter(time_label=time, min_depth__in=approx_mins)
-                            response[time][treatment_name][element][depth_str] = depth_geochem.aggregate(Avg(element))[ element + '__avg']
+                            # time 0 depths are averaged across treatments
+                            response[time][treatment_name][element][depth_str] = summaries.mean(time, None, element, depth_str)
                         else:
-                            depth_geochem = treatment_geochem.filter(time_label=time, min_depth=min_depth)
-                            response[time][treatment_name][element][depth_str] = depth_geochem.aggregate(Avg(element))[ element + '__avg']
-
-        cache.set('site-geochem', response)
-
-        return JsonResponse(response, safe=False)
+                            response[time][treatment_name][element][depth_str] = summaries.mean(time, treatment_id, element, depth_str)
 
+        return response
 
 
 class SiteMineralogy(views.APIView):
     """
-    Gets site geochemistry data for all time points, treatments, elements, and depths.
+    Gets site mineralogy data for all time points, treatments, minerals, and depths.
     """
 
     authentication_classes = []
@@ -378,101 +529,55 @@ class SiteMineralogy(views.APIView):
 
     def get(self, request, *args, **kwargs):
 
-        minerals = [
-            'quartz',
-            'plagioclase',
-            'illite',
-            'chlorite',
-            'kaolinite',
-            'pyrite',
-            'gypsum',
-            'jarosite',
-            'melanternite',
-            'ankerite',
-            'siderite',
-            'amorphous',
-        ]
-        
-        depths_time0 = [
-            [0, 5],
-            [5, 15],
-            [15, 25], 
-            [25, 35],
-            [35, 38],
-            [38, 54],
-            [180, 183],
-        ]
+        site_id = kwargs['site_id']
+        version = get_site_version(site_id)
+        response = self.get_site_data(site_id)
+        set_site_data('mineralogy', site_id, response, version)
 
-        depths = [
-            [0, 20],
-            [20, 40], 
-            [40, 60],
-            [60, 90]
-        ]
+        return SiteJsonResponse(response)
 
-        depths_mapping = {
-            '0-20': [[0, 5], [5, 15], [15, 25]],
-            '20-40': [[25, 35], [35, 38]],
-            '40-60': [[38, 54]],
-            '60-90': [],
-        }
+    def get_site_data(self, site_id):
 
-        site_id = kwargs['site_id']
-        site_mineralogy = Mineralogy.objects.filter(site=site_id)
-        
+        return self.build_site_data(
+            SiteSummaries(site_id, 'mineralogy'),
+            get_site_treatments(site_id),
+            get_depth_scheme(site_id),
+        )
+
+    def build_site_data(self, summaries, treatments, scheme):
+
+        treatment_ids, treatment_names = treatments
         response = {}
-        time_labels = list(site_mineralogy.values_list('time_label', flat=True).distinct())
 
-        # get plots, replicates & treatments for this site
-        replicate_ids = site_mineralogy.exclude(replicate=None).values_list('replicate', flat=True).distinct()
-        replicates = Replicate.objects.filter(id__in=replicate_ids)
-        plots = Plot.objects.filter(site_id=site_id)
-        treatment_ids = plots.values_list('treatment', flat=True).distinct()
-        
-        for time in time_labels:
+        for time in summaries.time_labels:
             response[time] = {}
 
             for treatment_id in treatment_ids:
-                treatment_name = Treatment.objects.get(id=treatment_id).description
+                treatment_name = treatment_names[treatment_id]
                 response[time][treatment_name] = {}
                 response[time]['raw'] = {}
-                treatment_replicates = replicates.filter(plot__treatment=treatment_id)
-                treatment_mineralogy = site_mineralogy.filter(time_label=time, replicate__in=treatment_replicates)
 
                 for mineral in minerals:
                     response[time][treatment_name][mineral] = {}
                     
                     if time == 0:
                         response[time]['raw'][mineral] = {}
-                        for depth in depths_time0:
-                            min_depth = depth[0]
-                            max_depth = depth[1]
-                            depth_str = '{}-{}'.format(min_depth, max_depth)
-                            depth_mineralogy = site_mineralogy.get(min_depth=min_depth, time_label=0)
-                            response[time]['raw'][mineral][depth_str] = getattr(depth_mineralogy, mineral)
-
-                    for depth in depths:
-                        min_depth = depth[0]
-                        max_depth = depth[1]
-                        depth_str = '{}-{}'.format(min_depth, max_depth)
+                        for depth_str in scheme.time0.labels:
+                            response[time]['raw'][mineral][depth_str] = summaries.raw(mineral, depth_str)
 
+                    for depth_str in scheme.later.labels:
                         if time == 0:
-                            approx_depths = depths_mapping[depth_str]
-                            approx_mins = [item[0] for item in approx_depths]
-                            depth_mineralogy = site_mineralogy.filter(time_label=time, min_depth__in=approx_mins)
-                            response[time][treatment_name][mineral][depth_str] = depth_mineralogy.aggregate(Avg(mineral))[ mineral + '__avg']
+                            # time 0 depths are averaged across treatments
+                            response[time][treatment_name][mineral][depth_str] = summaries.mean(time, None, mineral, depth_str)
                         else:
-                            depth_mineralogy = treatment_mineralogy.filter(min_depth=min_depth)
-                            response[time][treatment_name][mineral][depth_str] = depth_mineralogy.aggregate(Avg(mineral))[ mineral + '__avg']
+                            response[time][treatment_name][mineral][depth_str] = summaries.mean(time, treatment_id, mineral, depth_str)
 
-        cache.set('site-mineralogy', response)
-
-        return JsonResponse(response, safe=False)
+        return response
 
 
 class SiteExtractions(views.APIView):
     """
-    Gets site geochemistry data for all time points, treatments, elements, and depths.
+    Gets site extraction data for all time points, elements, solvents, and depths.
     """
 
     authentication_classes = []
@@ -480,72 +585,28 @@ class SiteExtractions(views.APIView):
 
     def get(self, request, *args, **kwargs):
 
-        elements = [
-            'Al',
-            'As',
-            'Ca',   
-            'Cr',    
-            'Fe',
-            'K',     
-            'Mg',
-            'Mn',     
-            'Pb',
-            'Ti',
-            'Zn',
-        ]
+        site_id = kwargs['site_id']
+        version = get_site_version(site_id)
+        response = self.get_site_data(site_id)
+        set_site_data('extractions', site_id, response, version)
 
-        solvents = [
-            'H20',
-            'AmNO3',
-            'AAc',
-            'PO4',
-            'AAO',
-            'CDB',
-        ]
+        return SiteJsonResponse(response)
 
-        depths_time0 = [
-            [0, 5],
-            [5, 15],
-            [15, 25], 
-            [25, 35],
-            [35, 38],
-            [38, 54],
-            [180, 183],
-        ]
+    def get_site_data(self, site_id):
 
-        depths = [
-            [0, 20],
-            [20, 40], 
-            [40, 60],
-            [60, 90]
-        ]
+        return self.build_site_data(SiteSummaries(site_id, 'extractions'), get_depth_scheme(site_id))
 
-        depths_mapping = {
-            '0-20': [[0, 5], [5, 15], [15, 25]],
-            '20-40': [[25, 35], [35, 38]],
-            '40-60': [[38, 54]],
-            '60-90': [],
-        }
+    def build_site_data(self, summaries, scheme):
 
-        site_id = kwargs['site_id']
-        site_extractions = Extraction.objects.filter(site=site_id)
-        
         response = {}
-        time_labels = list(site_extractions.values_list('time_label', flat=True).distinct())
-
-        # get plots, replicates & treatments for this site
-        replicate_ids = site_extractions.exclude(replicate=None).values_list('replicate', flat=True).distinct()
-        replicates = Replicate.objects.filter(id__in=replicate_ids)
-        plots = Plot.objects.filter(site_id=site_id)
-        treatment_ids = plots.values_list('treatment', flat=True).distinct()
-        
         response['raw'] = {}
-        for time in time_labels:
+
+        for time in summaries.time_labels:
             response[time] = {}
 
-            for element in elements:
+            for element in extraction_elements:
                 response[time][element] = {}
-                response['raw'][element] = {}
+                response['raw'].setdefault(element, {})
 
                 for solvent in solvents:
 
@@ -555,29 +616,208 @@ class SiteExtractions(views.APIView):
                         
                         response['raw'][element][solvent] = {}
 
-                        for depth in depths_time0:
-                            min_depth = depth[0]
-                            max_depth = depth[1]
-                            depth_str = '{}-{}'.format(min_depth, max_depth)
-                            depth_extraction = site_extractions.get(min_depth=min_depth, time_label=0, element=element)
-                            response['raw'][element][solvent][depth_str] = getattr(depth_extraction, solvent)
+                        for depth_str in scheme.time0.labels:
+                            response['raw'][element][solvent][depth_str] = summaries.raw(solvent, depth_str, element)
                 
-                    for depth in depths:
-                        min_depth = depth[0]
-                        max_depth = depth[1]
-                        depth_str = '{}-{}'.format(min_depth, max_depth)
+                    for depth_str in scheme.later.labels:
+                        response[time][element][solvent][depth_str] = summaries.mean(time, None, solvent, depth_str, element)
 
-                        if time == 0:
-                            approx_depths = depths_mapping[depth_str]
-                            approx_mins = [item[0] for item in approx_depths]
-                            depth_extractions = site_extractions.filter(time_label=time, min_depth__in=approx_mins, element=element)
-                            response[time][element][solvent][depth_str] = depth_extractions.aggregate(Avg(solvent))[ solvent + '__avg']
-                        else:
-                            depth_extractions = site_extractions.filter(time_label=time, min_depth=min_depth, element=element)
-                            response[time][element][treatment_name][depth_str] = depth_extractions.aggregate(Avg(solvent))[ solvent + '__avg']
+        return response
 
-        cache.set('site-extractions', response)
 
-        return JsonResponse(response, safe=False)
-    
+class SiteDashboard(views.APIView):
+    """
+    Gets the geochemistry, mineralogy, extractions, replicates and geochem
+    points payloads of a site in one response, keyed by name. The site's
+    plots, treatments and replicates are looked up once for all of them.
+
+    `?include=geochemistry,replicates` limits the response to some payloads.
+    """
+
+    authentication_classes = []
+    permission_classes = []
+
+    payloads = ['geochemistry', 'mineralogy', 'extractions', 'replicates', 'geochem-points']
+
+    def get(self, request, *args, **kwargs):
+
+        response = self.get_site_data(kwargs['site_id'], self.get_include())
+        return SiteJsonResponse(response)
+
+    def get_include(self):
+
+        include = self.request.query_params.get('include')
+        if not include:
+            return self.payloads
+
+        include = [name.strip() for name in include.split(',') if name.strip()]
+        unknown = [name for name in include if name not in self.payloads]
+        if unknown:
+            raise ValidationError({'include': 'Unknown payloads: {}'.format(', '.join(unknown))})
+
+        return include
+
+    def get_site_data(self, site_id, include):
+
+        hierarchy = SiteHierarchy(site_id)
+        scheme = get_depth_scheme(site_id)
+        summaries = SiteSummaries.for_datasets(
+            site_id,
+            [name for name in ['geochemistry', 'mineralogy', 'extractions'] if name in include],
+        )
+
+        response = {}
+
+        if 'geochemistry' in include:
+            response['geochemistry'] = SiteGeochemistry().build_site_data(
+                summaries['geochemistry'], hierarchy.treatments, scheme
+            )
+
+        if 'mineralogy' in include:
+            response['mineralogy'] = SiteMineralogy().build_site_data(
+                summaries['mineralogy'], hierarchy.treatments, scheme
+            )
+
+        if 'extractions' in include:
+            response['extractions'] = SiteExtractions().build_site_data(summaries['extractions'], scheme)
+
+        if 'replicates' in include:
+            response['replicates'] = ReplicateSerializer(hierarchy.replicates, many=True).data
+
+        if 'geochem-points' in include:
+            response['geochem-points'] = SiteGeochemPoints().build_site_data(self.get_points_rows(site_id, hierarchy))
+
+        return response
+
+    def get_points_rows(self, site_id, hierarchy):
+
+        # treatments come from the hierarchy instead of a join
+        fields = ['min_depth', 'max_depth', 'time_label', 'replicate_id']
+
+        for row in Geochemistry.objects.filter(site=site_id).values(*fields, *elements).iterator():
+            row['replicate__plot__treatment__label'] = hierarchy.replicate_treatments.get(row['replicate_id'])
+            yield row
+
+
+class SiteComparison(views.APIView):
+    """
+    Compares analytes across sites, from the depth-binned summaries.
+
+    `?analytes=Fe,As` (required) picks the analytes and `?sites=1,2` the
+    sites, every site by default. The response is a matrix with one row per
+    site, time point, treatment and depth bin, and one column per analyte.
+    Rows averaged across treatments, such as time 0, have a null treatment.
+    """
+
+    content_negotiation_class = SiteJsonContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+
+        dataset = kwargs['dataset']
+        analytes = self.get_analytes(dataset)
+        site_ids = self.get_site_ids()
+
+        return SiteJsonResponse(self.get_comparison_data(dataset, analytes, site_ids))
+
+    def get_analytes(self, dataset):
+
+        analytes = [
+            analyte.strip() for analyte in self.request.query_params.get('analytes', '').split(',')
+            if analyte.strip()
+        ]
+        if not analytes:
+            raise ValidationError({'analytes': 'At least one analyte is required.'})
+
+        unknown = [analyte for analyte in analytes if analyte not in DATASETS[dataset]['analytes']]
+        if unknown:
+            raise ValidationError({'analytes': 'Unknown analytes: {}'.format(', '.join(unknown))})
+
+        return list(dict.fromkeys(analytes))
+
+    def get_site_ids(self):
+
+        sites = self.request.query_params.get('sites')
+        if not sites:
+            return None
+
+        site_ids = [site_id.strip() for site_id in sites.split(',') if site_id.strip()]
+        if not all(site_id.isdigit() for site_id in site_ids):
+            raise ValidationError({'sites': 'Must be a comma-separated list of site ids.'})
+
+        return [int(site_id) for site_id in site_ids]
+
+    def get_comparison_data(self, dataset, analytes, site_ids=None):
+
+        summaries = DepthSummary.objects.filter(dataset=dataset, analyte__in=analytes, raw=False)
+        sites = Site.objects.all()
+        if site_ids is not None:
+            summaries = summaries.filter(site_id__in=site_ids)
+            sites = sites.filter(id__in=site_ids)
+
+        # one query for the values of every site, by row
+        columns = {analyte: i for i, analyte in enumerate(analytes)}
+        rows = {}
+        for site_id, time_label, treatment_id, treatment, depth_bin, analyte, mean in summaries.values_list(
+            'site_id', 'time_label', 'treatment_id', 'treatment__description', 'depth_bin', 'analyte', 'mean'
+        ).order_by():
+            key = (site_id, time_label, treatment_id, treatment, depth_bin)
+            rows.setdefault(key, [None] * len(analytes))[columns[analyte]] = mean
+
+        keys = sorted(rows, key=lambda key: (
+            key[0], key[1], key[2] is not None, key[2] or 0, depth_label_key(key[4])
+        ))
+
+        return {
+            'analytes': analytes,
+            'sites': [{'id': site_id, 'name': name} for site_id, name in sites.values_list('id', 'name').order_by('id')],
+            'index': {
+                'site': [key[0] for key in keys],
+                'time': [key[1] for key in keys],
+                'treatment': [key[3] for key in keys],
+                'depth': [key[4] for key in keys],
+            },
+            'values': [rows[key] for key in keys],
+        }
+
+
+class MeasurementExport(views.APIView):
+    """
+    Streams the raw rows of a dataset as NDJSON, or CSV with `?format=csv`.
+    With pyarrow installed, `?format=arrow` (Arrow IPC stream) and
+    `?format=parquet` return typed columns for loading into pandas.
+    `?site=<site_id>` limits the export to one site.
+    """
+
+    content_negotiation_class = SiteJsonContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+
+        dataset = kwargs['dataset']
+
+        export_format = request.query_params.get('format', 'ndjson')
+        if export_format not in EXPORTERS:
+            raise ValidationError({'format': 'Must be one of: {}'.format(', '.join(EXPORTERS))})
+
+        # checked up front, the status can't change once streaming starts
+        site_id = request.query_params.get('site')
+        if site_id is not None and not site_id.isdigit():
+            raise ValidationError({'site': 'Must be a site id.'})
+
+        response = StreamingHttpResponse(
+            EXPORTERS[export_format](dataset, site_id),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response['Content-Disposition'] = 'attachment; filename="{}{}.{}"'.format(
+            dataset, '-site-{}'.format(site_id) if site_id else '', export_format
+        )
+
+        return response
+
 
+# site data views by cached dataset name
+SITE_DATA_VIEWS = {
+    'geochemistry': SiteGeochemistry,
+    'mineralogy': SiteMineralogy,
+    'extractions': SiteExtractions,
+    'geochem-points': SiteGeochemPoints,
+}
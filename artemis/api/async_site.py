@@ -0,0 +1,118 @@
+"""
+Async versions of the site data views, for deployments served over ASGI
+(e.g. `uvicorn artemis.asgi:application`).
+
+Django 3.2 has no async ORM, so each view runs its independent queries
+concurrently on the site query pool and awaits them. A worker keeps serving
+other requests while a site's queries run.
+"""
+
+import asyncio
+
+from rest_framework.exceptions import ValidationError
+
+from artemis.api.api import (
+  SiteExtractions,
+  SiteGeochemistry,
+  SiteGeochemPoints,
+  SiteMineralogy,
+  get_site_treatments,
+)
+from artemis.api.http import SiteJsonResponse, cached_json_response
+from artemis.cache import get_site_json, get_site_version, set_site_data
+from artemis.depth_schemes import get_depth_scheme
+from artemis.executor import run_sync
+from artemis.summaries import SiteSummaries
+
+
+def build_and_store(dataset, site_id, build, results, version):
+    response = build(*results)
+    set_site_data(dataset, site_id, response, version)
+
+    return response
+
+
+async def site_data_response(dataset, site_id, build, *queries):
+    """
+    Runs the `(function, *args)` queries concurrently, then builds the
+    response from their results and stores it in the site cache.
+    """
+
+    # read before the queries, so a change made meanwhile isn't cached as current
+    version = await run_sync(get_site_version, site_id)
+    results = await asyncio.gather(*[run_sync(*query) for query in queries])
+    response = await run_sync(build_and_store, dataset, site_id, build, results, version)
+
+    return SiteJsonResponse(response)
+
+
+async def site_geochemistry(request, site_id):
+    """
+    Async version of `SiteGeochemistry`.
+    """
+
+    return await site_data_response(
+        'geochemistry',
+        site_id,
+        SiteGeochemistry().build_site_data,
+        (SiteSummaries, site_id, 'geochemistry'),
+        (get_site_treatments, site_id),
+        (get_depth_scheme, site_id),
+    )
+
+
+async def site_mineralogy(request, site_id):
+    """
+    Async version of `SiteMineralogy`.
+    """
+
+    return await site_data_response(
+        'mineralogy',
+        site_id,
+        SiteMineralogy().build_site_data,
+        (SiteSummaries, site_id, 'mineralogy'),
+        (get_site_treatments, site_id),
+        (get_depth_scheme, site_id),
+    )
+
+
+async def site_extractions(request, site_id):
+    """
+    Async version of `SiteExtractions`.
+    """
+
+    return await site_data_response(
+        'extractions',
+        site_id,
+        SiteExtractions().build_site_data,
+        (SiteSummaries, site_id, 'extractions'),
+        (get_depth_scheme, site_id),
+    )
+
+
+async def site_geochem_points(request, site_id):
+    """
+    Async version of `SiteGeochemPoints`.
+    """
+
+    view = SiteGeochemPoints()
+    columnar = request.GET.get('format') == 'columnar'
+
+    try:
+        point_elements = view.get_elements(request.GET.get('elements'))
+    except ValidationError as e:
+        return SiteJsonResponse(e.detail, status=400)
+
+    if point_elements is not None:
+        # element subsets aren't cached
+        build = view.build_columnar_site_data if columnar else view.build_site_data
+        rows = await run_sync(view.get_site_rows, site_id, point_elements)
+        return SiteJsonResponse(await run_sync(build, rows, point_elements))
+
+    # a single query, served from the site cache like the sync view
+    if columnar:
+        content = await run_sync(get_site_json, 'geochem-points-columnar', site_id, view.get_columnar_site_data)
+    else:
+        content = await run_sync(get_site_json, 'geochem-points', site_id, view.get_site_data)
+
+    return cached_json_response(request, content)
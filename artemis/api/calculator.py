@@ -2,6 +2,7 @@ import json
 import requests
 import time
 import os
+from functools import lru_cache
 from urllib.parse import urlencode, quote
 
 from django.http import HttpResponse, JsonResponse
@@ -12,118 +13,232 @@ from django.core.cache import cache
 
 from latex2sympy2 import latex2sympy, latex2latex
 from sympy import *
+import numpy as np
 
 from rest_framework import serializers, viewsets, generics, views
 from rest_framework.response import Response
 
 
-class LatexCalculator(views.APIView):
+# number of parsed & solved equations kept in memory
+EQUATION_CACHE_SIZE = 256
 
-    def get(self, request, *args, **kwargs):
-        
-        # vector values for variables
-        variable_vector = json.loads(request.query_params['variableVector'])
 
-        # latex string
-        latex = request.query_params['latex']
-        max_length = request.query_params['maxVectorLength']
-        solution_var = request.query_params['solutionVar']
+def vectorize_equation(sympy, var_names):
+    """
+    Replaces subscripted variable atoms (`x_{i}`, `x_i`) with indexed bases
+    over the variable's vector (`x_vec[i]`).
+    """
 
-        print(latex)
+    # store Sympy indexed bases for each variable
+    var_sympy_objects = {}
+    for var_name in var_names:
+        var_sympy_objects[var_name] = IndexedBase(var_name + "_vec")
 
-        # remove spaces from latex string
-        latex_clean = latex.replace("\\ ", "")
-        latex_clean = latex_clean.replace("=", "==")
-        print(latex_clean)
-        
-        # vector data only
-        var_vectors_clean = {}
-        # store Sympy indexed bases for each variable
-        var_sympy_objects = {}
+    atoms = sympy.atoms(Symbol)
+
+    for atom in atoms:
+    
+        for var_name in var_names:
+            atom_str = str(atom)
+            if atom_str.startswith(var_name + "_{"):
+                subscript = atom_str[atom_str.find("{")+1:atom_str.find("}")]
+                sympy = sympy.subs(atom_str, var_sympy_objects[var_name][subscript]) 
+            elif atom_str.startswith(var_name + "_"):
+                subscript = atom_str[2:]
+                sympy = sympy.subs(atom_str, var_sympy_objects[var_name][subscript]) 
+
+    return sympy
+
+
+class CompiledEquation:
+    """
+    A parsed equation together with its symbolic solution for the solution
+    variable. When the solution does not reference whole vectors it is also
+    lambdified, so it can be evaluated over every vector row in one pass.
+    Equations with several solutions are solved row by row, since the root
+    picked from each row's numeric solve depends on the row's values.
+    """
+
+    def __init__(self, equation, solution_var, var_names):
+        self.equation = equation
+        self.solution_var = solution_var
+        self.var_names = var_names
+        self.solution = None
+        self.function = None
+
+        try:
+            solutions = solve(equation, solution_var)
+        except (NotImplementedError, ValueError, TypeError):
+            solutions = []
+
+        if len(solutions) == 1:
+            self.solution = solutions[0]
+
+            if not self.solution.has(IndexedBase):
+                self.function = self.lambdify(self.solution)
+
+    def lambdify(self, solution):
+        var_symbols = [Symbol(var_name) for var_name in self.var_names]
+
+        # anything else left in the solution can only be solved row by row
+        if not solution.free_symbols <= set(var_symbols):
+            return None
+
+        return lambdify(var_symbols, solution, 'numpy')
+
+    def evaluate(self, vectors):
+        """
+        Returns the solution for each vector row as a string, in the same
+        format as solving the substituted equation row by row.
+        """
+
+        max_length = vectors.max_length
+
+        function = self.function
+        if function is None and self.solution is not None:
+            vec_subs = {
+                Symbol(var_name + "_vec"): vectors.arrays[var_name]
+                for var_name in self.var_names
+            }
+            function = self.lambdify(self.solution.subs(vec_subs).doit())
+
+        values = np.full(max_length, np.nan)
+        if function is not None:
+            var_rows = [vectors.rows[var_name] for var_name in self.var_names]
+            with np.errstate(all='ignore'):
+                try:
+                    values = np.broadcast_to(np.asarray(function(*var_rows), dtype=float), (max_length,))
+                except (TypeError, ValueError, ZeroDivisionError):
+                    pass
+
+        results = []
+        for i in range(max_length):
+
+            if np.isfinite(values[i]) and values[i] != 0:
+                results.append(str(Float(float(values[i]))))
+                continue
+
+            # complex, infinite or undefined results are left to sympy, and
+            # so are zeros, which sympy formats as exact integers
+            subs = {}
+            for var_name in self.var_names:
+                vector = vectors.variable_vector[var_name]
+
+                if len(vector) == 1:
+                    subs[var_name] = vector[0]['element_amount']
+                else:
+                    subs[var_name] = vector[i]['element_amount']
+
+                subs[var_name + "_vec"] = vectors.arrays[var_name]
+
+            sympy_result = self.equation.evalf(subs=subs)
+            var_result = solve(sympy_result, self.solution_var)
+            results.append(str(var_result[0]))
+
+        return results
+
+
+class VariableVectors:
+    """
+    Variable vector data parsed into arrays once, so it can be shared by every
+    equation evaluated over it.
+    """
+
+    def __init__(self, variable_vector, max_length):
+        self.variable_vector = variable_vector
+        self.max_length = max_length
+        # vector data only, as sympy arrays
+        self.arrays = {}
+        # per-row values, as arrays or as scalars for single value vectors
+        self.rows = {}
 
         for var_name in variable_vector:
-            var_sympy_objects[var_name] = IndexedBase(var_name + "_vec")
             vector = variable_vector[var_name]
-            vector_array = []
+            vector_array = [element['element_amount'] for element in vector]
+            self.arrays[var_name] = Array(vector_array)
 
-            for element in vector:
-                vector_array.append(element['element_amount'])
-            
-            var_vectors_clean[var_name] = Array(vector_array)
-
-        print(latex_clean)
-        sympy = latex2sympy(latex_clean)
-        print(sympy)
- 
-        # search for sums or products within expression
-        sums = sympy.find(Sum)
-        products = sympy.find(Product)
-        
-        sum_vars = []
-        
-        for s in sums:
-            
-            s_args = s.args
-            for i in range(len(s_args)):
-                if i > 0:
-                    sum_var = s_args[i][0]
-                    if sum_var not in sum_vars:
-                        sum_vars.append(sum_var)
-        
-        for s in products:
-            s_args = s.args
-            for i in range(len(s_args)):
-                if i > 0:
-                    sum_var = s_args[i][0]
-                    if sum_var not in sum_vars:
-                        sum_vars.append(sum_var)
-
-        atoms = sympy.atoms(Symbol)
-
-        sum_var_symbols = {}
-        for var in sum_vars:
-            sum_var_symbols[var] = symbols(str(var))
-        
+            if len(vector) == 1:
+                self.rows[var_name] = float_or_nan(vector_array[0])
+            else:
+                self.rows[var_name] = np.array([float_or_nan(amount) for amount in vector_array[:max_length]])
 
-        for atom in atoms:
-        
-            for var_name in variable_vector:
-                atom_str = str(atom)
-                if atom_str.startswith(var_name + "_{"):
-                    subscript = atom_str[atom_str.find("{")+1:atom_str.find("}")]
-                    sympy = sympy.subs(atom_str, var_sympy_objects[var_name][subscript]) 
-                elif atom_str.startswith(var_name + "_"):
-                    subscript = atom_str[2:]
-                    sympy = sympy.subs(atom_str, var_sympy_objects[var_name][subscript]) 
+    def result_rows(self, solution_var, var_results):
+        """
+        Pairs each solution with the vector rows it was computed from.
+        """
 
         solutions = []
 
-        for i in range(0, int(max_length)):
+        for i in range(0, self.max_length):
             
             result = {}
-            subs = {}
 
-            for var_name in variable_vector:
+            for var_name in self.variable_vector:
             
-                vector = variable_vector[var_name]
-                print(vector)
+                vector = self.variable_vector[var_name]
 
                 if len(vector) == 1:
                     result[var_name] = vector[0]
-                    subs[var_name] = vector[0]['element_amount']
                 else:
                     result[var_name] = vector[i]
-                    subs[var_name] = vector[i]['element_amount']
-            
-                subs[var_name + "_vec"] = var_vectors_clean[var_name]
 
             result[solution_var] = {}
-            sympy_result = sympy.evalf(subs=subs)
-            print(sympy_result)
-            var_result = solve(sympy_result, solution_var)
-            print(var_result)
-            result[solution_var]['element_amount'] = str(var_result[0])
+            result[solution_var]['element_amount'] = var_results[i]
             solutions.append(result)
+
+        return solutions
+
+
+def clean_simple_expression(latex):
+    # remove spaces from latex string
+    expression_clean = latex.replace("\\ ", "")
+    expression_clean = expression_clean.replace("^", "**")
+
+    return expression_clean
+
+
+def float_or_nan(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+@lru_cache(maxsize=EQUATION_CACHE_SIZE)
+def compile_latex(latex_clean, solution_var, var_names):
+    sympy = latex2sympy(latex_clean)
+    sympy = vectorize_equation(sympy, var_names)
+
+    return CompiledEquation(sympy, solution_var, var_names)
+
+
+@lru_cache(maxsize=EQUATION_CACHE_SIZE)
+def compile_simple(expression_clean, solution_var, var_names):
+    sympy = Eq(*map(parse_expr, expression_clean.split("=")))
+    sympy = vectorize_equation(sympy, var_names)
+
+    return CompiledEquation(sympy, solution_var, var_names)
+
+
+class LatexCalculator(views.APIView):
+
+    def get(self, request, *args, **kwargs):
+        
+        # vector values for variables
+        variable_vector = json.loads(request.query_params['variableVector'])
+
+        # latex string
+        latex = request.query_params['latex']
+        max_length = int(request.query_params['maxVectorLength'])
+        solution_var = request.query_params['solutionVar']
+
+        # remove spaces from latex string
+        latex_clean = latex.replace("\\ ", "")
+        latex_clean = latex_clean.replace("=", "==")
+
+        vectors = VariableVectors(variable_vector, max_length)
+        compiled = compile_latex(latex_clean, solution_var, tuple(variable_vector))
+        solutions = vectors.result_rows(solution_var, compiled.evaluate(vectors))
     
         response = {
             'solution': solutions
@@ -141,111 +256,100 @@ class SimpleCalculator(views.APIView):
 
         # latex string
         latex = request.query_params['latex']
-        max_length = request.query_params['maxVectorLength']
+        max_length = int(request.query_params['maxVectorLength'])
         solution_var = request.query_params['solutionVar']
 
-        print(latex)
+        vectors = VariableVectors(variable_vector, max_length)
+        compiled = compile_simple(clean_simple_expression(latex), solution_var, tuple(variable_vector))
+        solutions = vectors.result_rows(solution_var, compiled.evaluate(vectors))
+    
+        response = {
+            'solution': solutions
+        }
 
-        # remove spaces from latex string
-        latex_clean = latex.replace("\\ ", "")
-        latex_clean = latex_clean.replace("^", "**")
-        print(latex_clean)
-        
-        # vector data only
-        var_vectors_clean = {}
-        # store Sympy indexed bases for each variable
-        var_sympy_objects = {}
+        return JsonResponse(response, safe=False)
 
-        for var_name in variable_vector:
-            var_sympy_objects[var_name] = IndexedBase(var_name + "_vec")
-            vector = variable_vector[var_name]
-            vector_array = []
 
-            for element in vector:
-                vector_array.append(element['element_amount'])
-            
-            var_vectors_clean[var_name] = Array(vector_array)
-
-        print(latex_clean)
-        print("HEREEEEEE")
-        print(latex_clean.split("="))
-        sympy = Eq(*map(parse_expr, latex_clean.split("=")))
-        # sympy = latex2sympy(latex_clean)
-        print(sympy)
- 
-        # search for sums or products within expression
-        sums = sympy.find(Sum)
-        products = sympy.find(Product)
-        
-        sum_vars = []
-        
-        for s in sums:
-            
-            s_args = s.args
-            for i in range(len(s_args)):
-                if i > 0:
-                    sum_var = s_args[i][0]
-                    if sum_var not in sum_vars:
-                        sum_vars.append(sum_var)
-        
-        for s in products:
-            s_args = s.args
-            for i in range(len(s_args)):
-                if i > 0:
-                    sum_var = s_args[i][0]
-                    if sum_var not in sum_vars:
-                        sum_vars.append(sum_var)
-
-        atoms = sympy.atoms(Symbol)
-
-        sum_var_symbols = {}
-        for var in sum_vars:
-            sum_var_symbols[var] = symbols(str(var))
-        
+class EquationSerializer(serializers.Serializer):
+    latex = serializers.CharField(trim_whitespace=False)
+    solutionVar = serializers.CharField()
 
-        for atom in atoms:
-        
-            for var_name in variable_vector:
-                atom_str = str(atom)
-                if atom_str.startswith(var_name + "_{"):
-                    subscript = atom_str[atom_str.find("{")+1:atom_str.find("}")]
-                    sympy = sympy.subs(atom_str, var_sympy_objects[var_name][subscript]) 
-                elif atom_str.startswith(var_name + "_"):
-                    subscript = atom_str[2:]
-                    sympy = sympy.subs(atom_str, var_sympy_objects[var_name][subscript]) 
 
-        solutions = []
+class SimpleCalculatorBatchSerializer(serializers.Serializer):
+    variableVector = serializers.DictField(
+        child=serializers.ListField(child=serializers.DictField(), allow_empty=False),
+    )
+    maxVectorLength = serializers.IntegerField(min_value=0)
+    equations = EquationSerializer(many=True)
 
-        for i in range(0, int(max_length)):
-            
-            result = {}
-            subs = {}
+    def validate_variableVector(self, value):
 
-            for var_name in variable_vector:
-            
-                vector = variable_vector[var_name]
-                print(vector)
+        for var_name, vector in value.items():
+            if any('element_amount' not in element for element in vector):
+                raise serializers.ValidationError(
+                    'Every element of "{}" needs an element_amount.'.format(var_name)
+                )
 
-                if len(vector) == 1:
-                    result[var_name] = vector[0]
-                    subs[var_name] = vector[0]['element_amount']
-                else:
-                    result[var_name] = vector[i]
-                    subs[var_name] = vector[i]['element_amount']
-            
-                subs[var_name + "_vec"] = var_vectors_clean[var_name]
+        return value
+
+    def validate(self, data):
+
+        # single value vectors are shared by every row
+        for var_name, vector in data['variableVector'].items():
+            if len(vector) != 1 and len(vector) < data['maxVectorLength']:
+                raise serializers.ValidationError({
+                    'variableVector': 'Vector "{}" is shorter than maxVectorLength.'.format(var_name),
+                })
+
+        return data
+
+
+class SimpleCalculatorBatch(views.APIView):
+    """
+    Solves a list of equations over one shared set of variable vectors.
+
+    POST body:
+    variableVector -> object of vectors, as for SimpleCalculator
+    maxVectorLength -> int
+    equations -> list of {"latex": string, "solutionVar": string}
+    """
+
+    def post(self, request, *args, **kwargs):
+
+        serializer = SimpleCalculatorBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        variable_vector = serializer.validated_data['variableVector']
+        max_length = serializer.validated_data['maxVectorLength']
+        equations = serializer.validated_data['equations']
+
+        # parse the variable data once for every equation
+        vectors = VariableVectors(variable_vector, max_length)
+        var_names = tuple(variable_vector)
+
+        solutions = []
+
+        for equation in equations:
+            latex = equation['latex']
+            solution_var = equation['solutionVar']
+            result = {
+                'latex': latex,
+                'solutionVar': solution_var,
+            }
+
+            try:
+                compiled = compile_simple(clean_simple_expression(latex), solution_var, var_names)
+                result['solution'] = [
+                    {'element_amount': var_result} for var_result in compiled.evaluate(vectors)
+                ]
+            except Exception as e:
+                # one bad formula should not fail the whole batch
+                result['error'] = str(e)
 
-            result[solution_var] = {}
-            sympy_result = sympy.evalf(subs=subs)
-            print(sympy_result)
-            var_result = solve(sympy_result, solution_var)
-            print(var_result)
-            result[solution_var]['element_amount'] = str(var_result[0])
             solutions.append(result)
-    
+
         response = {
-            'solution': solutions
+            'solutions': solutions
         }
 
         return JsonResponse(response, safe=False)
-
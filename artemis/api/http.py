@@ -0,0 +1,198 @@
+"""
+JSON encoding, conditional GET and compression for the site data routes.
+"""
+
+import gzip
+import hashlib
+import re
+from functools import wraps
+
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.text import compress_string
+
+from artemis.cache import get_site_version
+from artemis.encoders import get_json_encoder
+from artemis.executor import run_sync
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# responses smaller than this are not worth compressing
+MIN_COMPRESS_LENGTH = 200
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+class SiteJsonResponse(HttpResponse):
+    """
+    JSON response for the large hand-built site payloads, encoded with the
+    fastest available encoder.
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=get_json_encoder()(data), **kwargs)
+
+
+def cached_json_response(request, content):
+    """
+    Returns gzip-compressed JSON from the site cache as is to clients that
+    accept gzip, and decompressed for the others.
+    """
+
+    if re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(content, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(content), content_type='application/json')
+
+    response['Content-Length'] = str(len(response.content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    return response
+
+
+def site_etag(dataset):
+    """
+    Returns an ETag function for a site data view. The ETag changes whenever
+    the site's data version does, so unchanged payloads are answered with a
+    304 before the view builds them.
+    """
+
+    def etag_func(request, *args, **kwargs):
+        # the query string & accepted types select different representations
+        variant = hashlib.md5('{}|{}'.format(
+            request.META.get('QUERY_STRING', ''),
+            request.META.get('HTTP_ACCEPT', ''),
+        ).encode()).hexdigest()[:12]
+
+        return 'W/"{}-{}-{}-{}"'.format(
+            dataset,
+            kwargs['site_id'],
+            get_site_version(kwargs['site_id']),
+            variant,
+        )
+
+    return etag_func
+
+
+def compress_response(request, response):
+    """
+    Compresses a response body with brotli (when installed) or gzip,
+    depending on what the client accepts.
+    """
+
+    # DRF responses are rendered after the view returns
+    if getattr(response, 'is_rendered', True) is False:
+        response.add_post_render_callback(lambda response: compress_response(request, response))
+        return response
+
+    if response.streaming or response.has_header('Content-Encoding'):
+        return response
+
+    if not 200 <= response.status_code < 300 or len(response.content) < MIN_COMPRESS_LENGTH:
+        return response
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+    if brotli is not None and re_accepts_brotli.search(accept_encoding):
+        content = brotli.compress(response.content, quality=5)
+        encoding = 'br'
+    elif re_accepts_gzip.search(accept_encoding):
+        content = compress_string(response.content)
+        encoding = 'gzip'
+    else:
+        return response
+
+    if len(content) >= len(response.content):
+        return response
+
+    response.content = content
+    response['Content-Length'] = str(len(content))
+    response['Content-Encoding'] = encoding
+
+    return response
+
+
+def compress_page(view_func):
+    """
+    Decorator compressing a view's response for clients that accept it.
+    """
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        return compress_response(request, response)
+
+    return _wrapped_view
+
+
+def tag_response(response, etag):
+    """
+    Sets the ETag of a successful or not modified response. Errors, such as
+    a 400 for invalid parameters, aren't tagged so they aren't revalidated
+    as if they were the site's data.
+    """
+
+    if response.status_code in (200, 304) and not response.has_header('ETag'):
+        response['ETag'] = etag
+
+    return response
+
+
+def site_data_view(view_func, dataset):
+    """
+    Wraps a site data view with conditional GET handling and compression.
+    """
+
+    etag_func = site_etag(dataset)
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+
+        if request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+
+        etag = etag_func(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view_func(request, *args, **kwargs)
+            response = compress_response(request, response)
+
+        return tag_response(response, etag)
+
+    return _wrapped_view
+
+
+def async_site_data_view(view_func, dataset):
+    """
+    Async counterpart of `site_data_view`, for the async site views.
+    """
+
+    etag_func = site_etag(dataset)
+
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+        # the site version is read from the cache, which may be remote
+        etag = await run_sync(etag_func, request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view_func(request, *args, **kwargs)
+            response = await run_sync(compress_response, request, response)
+
+        return tag_response(response, etag)
+
+    return _wrapped_view
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from artemis.metrics import registry
+
+
+def metrics(request):
+    """
+    Returns this process's request metrics in the Prometheus text format.
+    Only served to the addresses in METRICS_ALLOWED_IPS.
+    """
+
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+
+    if request.META.get('REMOTE_ADDR') not in allowed_ips:
+        raise Http404
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ArtemisConfig(AppConfig):
+    name = 'artemis'
+
+    def ready(self):
+        # connect cache invalidation & query metrics handlers
+        from artemis import signals  # noqa: F401
@@ -0,0 +1,204 @@
+"""
+Vectorized depth binning of a site's measurements.
+
+A site dataset is loaded once into NumPy arrays: an analyte matrix (rows by
+analytes, NULL as NaN) and time label, treatment, element and depth arrays.
+Rows are assigned to the bins of the site's depth scheme, and the means of
+every bin are then computed with one grouped reduction.
+NaN values are skipped and counted out, the way SQL AVG skips NULL, and a
+bin with no values has a mean of None.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+
+# kinds of depth bins, the first column of the group keys
+LATER = 0
+TIME0 = 1
+RAW = 2
+
+# treatment & element codes of rows without one
+NO_TREATMENT = -1
+NO_ELEMENT = -1
+
+# the average of one analyte in a depth bin, with the sum & count of its
+# non-null values and the number of samples in the bin
+BinSummary = namedtuple('BinSummary', [
+    'time_label',
+    'treatment_id',
+    'element',
+    'analyte',
+    'depth_bin',
+    'raw',
+    'mean',
+    'n',
+    'total',
+    'samples',
+])
+
+
+class Measurements:
+    """
+    The rows of a site dataset as arrays.
+    """
+
+    def __init__(self, rows, analytes, by_element=False):
+        # rows are (time_label, min_depth, max_depth, treatment, [element,] *analytes)
+        rows = list(rows)
+        offset = 5 if by_element else 4
+        columns = list(zip(*rows)) if rows else [()] * offset
+
+        self.analytes = analytes
+        self.time_labels = np.array(columns[0], dtype=np.int64)
+        self.min_depths = np.array(columns[1], dtype=np.int64)
+        self.max_depths = np.array(columns[2], dtype=np.int64)
+        self.treatments = np.array(
+            [NO_TREATMENT if treatment is None else treatment for treatment in columns[3]],
+            dtype=np.int64,
+        )
+
+        self.element_names = []
+        self.elements = np.full(len(rows), NO_ELEMENT, dtype=np.int64)
+        if by_element:
+            for element in columns[4]:
+                if element not in self.element_names:
+                    self.element_names.append(element)
+            codes = {element: i for i, element in enumerate(self.element_names)}
+            self.elements = np.array([codes[element] for element in columns[4]], dtype=np.int64)
+
+        # None becomes NaN
+        self.values = np.array(
+            [row[offset:] for row in rows],
+            dtype=np.float64,
+        ).reshape(len(rows), len(analytes))
+
+    @staticmethod
+    def lookups(analytes, by_element=False):
+        """
+        Returns the ORM lookups of the row values the measurements are built from.
+        """
+
+        lookups = ['time_label', 'min_depth', 'max_depth', 'replicate__plot__treatment']
+        if by_element:
+            lookups.append('element')
+
+        return lookups + list(analytes)
+
+    @classmethod
+    def load(cls, queryset, analytes, by_element=False):
+        """
+        Loads the measurements of a queryset with one query.
+        """
+
+        rows = queryset.values_list(*cls.lookups(analytes, by_element)).order_by()
+        return cls(rows, analytes, by_element)
+
+    def element(self, code):
+        return '' if code == NO_ELEMENT else self.element_names[code]
+
+
+def grouped_sums(keys, values):
+    """
+    Groups the rows of `values` by the rows of `keys`. Returns the unique
+    keys, the per-column sums and non-NaN counts of each group, and the
+    number of rows in each group.
+    """
+
+    if not len(keys):
+        return keys, np.empty(values.shape), np.zeros(values.shape, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # sort rows by key, then reduce each run of equal keys
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)])
+    unique_keys = sorted_keys[starts]
+
+    values = values[order]
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present, values, 0.0), starts, axis=0)
+    counts = np.add.reduceat(present.astype(np.int64), starts, axis=0)
+    sizes = np.diff(np.r_[starts, len(keys)])
+
+    return unique_keys, sums, counts, sizes
+
+
+def depth_bin_means(measurements, scheme, treatment_ids=None):
+    """
+    Computes the depth bin means of a site dataset, for the bins of a
+    `DepthSchemeIndex`:
+
+    - later time points by time label, later bin and, when `treatment_ids`
+      is given, treatment (rows of other treatments are left out),
+    - time 0 samples folded into the later bins,
+    - raw time 0 samples by time 0 bin.
+
+    Extractions are grouped by element as well. Returns a list of
+    `BinSummary`.
+    """
+
+    m = measurements
+    time0 = m.time_labels == 0
+
+    no_treatments = np.full(len(m.treatments), NO_TREATMENT, dtype=np.int64)
+
+    # time 0 samples are folded into the later bins they overlap
+    later_bins = scheme.later.assign(m.min_depths, m.max_depths)
+    later = ~time0 & (later_bins >= 0)
+    folded = time0 & (later_bins >= 0)
+    if treatment_ids is None:
+        later_treatments = no_treatments
+    else:
+        later &= np.isin(m.treatments, list(treatment_ids))
+        later_treatments = m.treatments
+
+    raw_bins = scheme.time0.assign(m.min_depths, m.max_depths)
+    raw = time0 & (raw_bins >= 0)
+
+    # time 0 rows can be both folded & raw, so each kind takes its own copy
+    def group_keys(kind, mask, treatments, bins):
+        return np.column_stack([
+            np.full(mask.sum(), kind, dtype=np.int64),
+            m.time_labels[mask],
+            treatments[mask],
+            m.elements[mask],
+            bins[mask],
+        ])
+
+    keys = np.concatenate([
+        group_keys(LATER, later, later_treatments, later_bins),
+        group_keys(TIME0, folded, no_treatments, later_bins),
+        group_keys(RAW, raw, no_treatments, raw_bins),
+    ])
+    values = np.concatenate([m.values[later], m.values[folded], m.values[raw]])
+
+    unique_keys, sums, counts, sizes = grouped_sums(keys, values)
+
+    results = []
+
+    for (kind, time_label, treatment, element, depth_index), group_sums, group_counts, samples in zip(
+        unique_keys.tolist(), sums.tolist(), counts.tolist(), sizes.tolist()
+    ):
+        if kind == RAW:
+            depth_bin = scheme.time0.labels[depth_index]
+        else:
+            depth_bin = scheme.later.labels[depth_index]
+
+        treatment_id = None if treatment == NO_TREATMENT else treatment
+
+        for analyte, total, n in zip(m.analytes, group_sums, group_counts):
+            results.append(BinSummary(
+                time_label=time_label,
+                treatment_id=treatment_id,
+                element=m.element(element),
+                analyte=analyte,
+                depth_bin=depth_bin,
+                raw=kind == RAW,
+                mean=total / n if n else None,
+                n=n,
+                total=total,
+                samples=samples,
+            ))
+
+    return results
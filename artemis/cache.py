@@ -0,0 +1,143 @@
+"""
+Per-site cache for the site data payloads.
+
+Payloads are stored as gzip-compressed JSON under a key per site and dataset,
+together with the site's data version at the time they were computed. The
+current version is stored under its own key and read in the same round trip
+as the payload, so a lookup is one cache call; a payload computed for an
+older version is treated as a miss.
+
+Any cache backend works. Deployments with several web hosts should use a
+shared one (e.g. memcached) so that every host sees the same payloads and
+invalidations.
+"""
+
+import gzip
+import uuid
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from artemis.encoders import get_json_encoder
+from artemis.metrics import record_site_cache
+
+
+SITE_DATASETS = [
+    'geochemistry',
+    'mineralogy',
+    'extractions',
+    'geochem-points',
+    'geochem-points-columnar',
+]
+
+
+def site_cache_timeout():
+    return getattr(settings, 'SITE_CACHE_TIMEOUT', None)
+
+
+def site_cache_compress_level():
+    return getattr(settings, 'SITE_CACHE_COMPRESS_LEVEL', 6)
+
+
+def site_cache_max_size():
+    return getattr(settings, 'SITE_CACHE_MAX_SIZE', 1000 * 1000)
+
+
+def site_version_key(site_id):
+    return 'site-version:{}'.format(site_id)
+
+
+def site_cache_key(dataset, site_id):
+    return 'site-{}:{}'.format(dataset, site_id)
+
+
+def new_site_version(site_id):
+    version = uuid.uuid4().hex
+
+    # another process may have created the version in the meantime
+    if not cache.add(site_version_key(site_id), version, timeout=site_cache_timeout()):
+        version = cache.get(site_version_key(site_id), version)
+
+    return version
+
+
+def get_site_version(site_id):
+    """
+    Returns the current data version for a site, creating one if the cache
+    has none (first use, or the cache was flushed).
+    """
+
+    version = cache.get(site_version_key(site_id))
+
+    if version is None:
+        version = new_site_version(site_id)
+
+    return version
+
+
+def encode_site_data(data):
+    return gzip.compress(get_json_encoder()(data), compresslevel=site_cache_compress_level())
+
+
+def get_site_json(dataset, site_id, compute):
+    """
+    Returns the cached payload for a site dataset, as gzip-compressed JSON.
+    On a miss, the payload is computed with `compute(site_id)` and stored.
+    """
+
+    version_key = site_version_key(site_id)
+    key = site_cache_key(dataset, site_id)
+
+    values = cache.get_many([version_key, key])
+    version = values.get(version_key)
+    entry = values.get(key)
+
+    if version is None:
+        version = new_site_version(site_id)
+
+    if entry is not None and entry[0] == version:
+        record_site_cache(dataset, hit=True)
+        return entry[1]
+
+    record_site_cache(dataset, hit=False)
+
+    content = encode_site_data(compute(site_id))
+    store_site_entry(key, version, content)
+
+    return content
+
+
+def set_site_data(dataset, site_id, data, version):
+    """
+    Stores a site payload, computed after `version` was read from
+    `get_site_version`. A payload computed while the site changed is stored
+    under the older version, so it is never served.
+    """
+
+    store_site_entry(site_cache_key(dataset, site_id), version, encode_site_data(data))
+
+
+def store_site_entry(key, version, content):
+    # payloads over the backend's item size limit are recomputed instead
+    if len(content) <= site_cache_max_size():
+        cache.set(key, (version, content), timeout=site_cache_timeout())
+
+
+def invalidate_site(site_id):
+    """
+    Drops every cached payload for a site.
+    """
+
+    cache.set(site_version_key(site_id), uuid.uuid4().hex, timeout=site_cache_timeout())
+    cache.delete_many([site_cache_key(dataset, site_id) for dataset in SITE_DATASETS])
+
+
+def invalidate_site_on_commit(site_id):
+    """
+    Drops the cached payloads of a site once the current transaction
+    commits, so they aren't recomputed from the old rows in the meantime.
+    """
+
+    transaction.on_commit(partial(invalidate_site, site_id))
@@ -0,0 +1,30 @@
+"""
+Bulk deletes.
+
+Measurement signals update the summaries of a site row by row, which is
+quick for a single measurement but costs several queries per row when many
+are deleted, e.g. by a cascade from their site, plot or replicate. Deletes
+that can remove many measurements run in `bulk_delete()`, where the signals
+schedule one refresh per site instead.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+_state = threading.local()
+
+
+@contextmanager
+def bulk_delete():
+    depth = getattr(_state, 'depth', 0)
+    _state.depth = depth + 1
+
+    try:
+        yield
+    finally:
+        _state.depth = depth
+
+
+def in_bulk_delete():
+    return getattr(_state, 'depth', 0) > 0
@@ -0,0 +1,192 @@
+"""
+Depth schemes: the depth bins measurements are averaged into.
+
+Schemes are stored as DepthScheme & DepthBin rows, per site or as a default
+for every site, and loaded into interval indexes that are cached in each
+process. Saving a scheme bumps a version in the shared cache, so every
+process reloads it on next use.
+"""
+
+import threading
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q
+
+from artemis.models import DepthBin
+
+
+# built-in scheme, used when the database has no default scheme
+
+# sampled depths at time 0
+depths_time0 = [
+    [0, 5],
+    [5, 15],
+    [15, 25],
+    [25, 35],
+    [35, 38],
+    [38, 54],
+    [180, 183],
+]
+
+# sampled depths at later time points
+depths = [
+    [0, 20],
+    [20, 40],
+    [40, 60],
+    [60, 90]
+]
+
+SCHEME_VERSION_KEY = 'depth-schemes-version'
+
+# samples taken at a single depth are treated as this thick
+POINT_SAMPLE_DEPTH = 1e-6
+
+
+def depth_label(depth):
+    return '{}-{}'.format(depth[0], depth[1])
+
+
+def depth_label_key(label):
+    """
+    Sort key ordering depth labels by depth.
+    """
+
+    return tuple(float(depth) for depth in label.split('-'))
+
+
+class IntervalIndex:
+    """
+    Sorted, non-overlapping depth intervals. Samples are assigned to the
+    interval they overlap most, found with a binary search per sample. Ties
+    go to the shallower interval.
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted([min_depth, max_depth] for min_depth, max_depth in intervals)
+        self.labels = [depth_label(interval) for interval in self.intervals]
+        self.min_depths = np.array([interval[0] for interval in self.intervals], dtype=np.float64)
+        self.max_depths = np.array([interval[1] for interval in self.intervals], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def assign(self, min_depths, max_depths):
+        """
+        Returns the index of the interval each sample overlaps most, or -1
+        for samples overlapping none.
+        """
+
+        min_depths = np.asarray(min_depths, dtype=np.float64)
+        max_depths = np.asarray(max_depths, dtype=np.float64)
+        max_depths = np.maximum(max_depths, min_depths + POINT_SAMPLE_DEPTH)
+
+        best = np.full(len(min_depths), -1, dtype=np.int64)
+        best_overlap = np.zeros(len(min_depths))
+
+        # the first interval ending below the top of each sample, then the
+        # following ones while they start above its bottom
+        first = np.searchsorted(self.max_depths, min_depths, side='right')
+
+        for offset in range(len(self)):
+            candidates = first + offset
+            valid = candidates < len(self)
+            candidates = np.where(valid, candidates, 0)
+
+            valid &= self.min_depths[candidates] < max_depths
+            if not valid.any():
+                break
+
+            overlap = (
+                np.minimum(max_depths, self.max_depths[candidates]) -
+                np.maximum(min_depths, self.min_depths[candidates])
+            )
+            better = valid & (overlap > best_overlap)
+
+            best[better] = candidates[better]
+            best_overlap[better] = overlap[better]
+
+        return best
+
+
+class DepthSchemeIndex:
+    """
+    The bins of a depth scheme: `later` for the later time points, which
+    time 0 samples are also folded into, and `time0` for the raw time 0
+    samples.
+    """
+
+    def __init__(self, later, time0):
+        self.later = IntervalIndex(later)
+        self.time0 = IntervalIndex(time0)
+
+
+def load_depth_scheme(site_id):
+    """
+    Loads the depth scheme of a site from the database, with one query:
+    the site's own scheme, or else the default one, or else the built-in
+    depths.
+    """
+
+    bins = DepthBin.objects.filter(Q(scheme__site_id=site_id) | Q(scheme__site=None)).values_list(
+        'scheme_id', 'scheme__site_id', 'kind', 'min_depth', 'max_depth'
+    )
+
+    schemes = {}
+    for scheme_id, scheme_site_id, kind, min_depth, max_depth in bins:
+        scheme = schemes.setdefault((scheme_site_id is None, scheme_id), {'later': [], 'time0': []})
+        scheme[kind].append([min_depth, max_depth])
+
+    if not schemes:
+        return DepthSchemeIndex(depths, depths_time0)
+
+    # the site's scheme sorts before the defaults
+    scheme = schemes[min(schemes)]
+    return DepthSchemeIndex(scheme['later'], scheme['time0'])
+
+
+_indexes = {}
+_indexes_version = None
+_indexes_lock = threading.Lock()
+
+
+def get_depth_scheme(site_id):
+    """
+    Returns the depth scheme of a site from the process cache, loading it
+    when the cached schemes are missing or out of date.
+    """
+
+    global _indexes_version
+
+    site_id = int(site_id)
+
+    version = cache.get(SCHEME_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(SCHEME_VERSION_KEY, version, timeout=None):
+            version = cache.get(SCHEME_VERSION_KEY, version)
+
+    with _indexes_lock:
+        if version != _indexes_version:
+            _indexes.clear()
+            _indexes_version = version
+
+        index = _indexes.get(site_id)
+
+    if index is None:
+        index = load_depth_scheme(site_id)
+
+        with _indexes_lock:
+            if _indexes_version == version:
+                _indexes[site_id] = index
+
+    return index
+
+
+def invalidate_depth_schemes():
+    """
+    Makes every process reload its depth schemes.
+    """
+
+    cache.set(SCHEME_VERSION_KEY, uuid.uuid4().hex, timeout=None)
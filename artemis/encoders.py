@@ -0,0 +1,40 @@
+"""
+JSON encoders for the site payloads.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json_stdlib(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+
+
+def encode_json_orjson(data):
+    # site payloads are keyed by integer time labels
+    return orjson.dumps(data, default=DjangoJSONEncoder().default, option=orjson.OPT_NON_STR_KEYS)
+
+
+JSON_ENCODERS = {
+    'json': encode_json_stdlib,
+}
+
+if orjson is not None:
+    JSON_ENCODERS['orjson'] = encode_json_orjson
+
+
+def get_json_encoder():
+    """
+    Returns the JSON encoder named by the JSON_ENCODER setting, defaulting to
+    orjson when it is installed and the standard library otherwise.
+    """
+
+    name = getattr(settings, 'JSON_ENCODER', None) or ('orjson' if orjson is not None else 'json')
+    return JSON_ENCODERS[name]
@@ -0,0 +1,56 @@
+"""
+Bounded thread pool for the blocking database & cache calls of the async
+views. Django 3.2 has no async ORM, so the async views hand their queries to
+these threads and await them, running independent queries concurrently
+while the event loop serves other requests.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SITE_QUERY_THREADS', 8),
+                thread_name_prefix='site-query',
+            )
+
+    return _executor
+
+
+def call_and_close(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # request_finished only cleans up the connections of the thread
+        # that handled the request, not the pool's
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Runs a blocking function on the site query pool and returns its result.
+    The caller's context, including the request metrics, is passed along.
+    """
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(
+        get_executor(),
+        functools.partial(context.run, call_and_close, func, args, kwargs),
+    )
@@ -0,0 +1,232 @@
+"""
+Streaming export of raw measurements as NDJSON, CSV and, when pyarrow is
+installed, Arrow IPC or Parquet.
+
+Rows are read with a chunked iterator (a server-side cursor on PostgreSQL)
+and written as they are read, so memory stays flat however many rows are
+exported. The CSV columns match the ones `load_site_data` reads, so an
+export can be loaded again.
+"""
+
+import csv
+import io
+import itertools
+from functools import partial
+
+from django.db import models
+
+from artemis.encoders import get_json_encoder
+from artemis.summaries import DATASETS
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# site & replicate are exported by name & label, as load_site_data reads them
+LOOKUP_COLUMNS = [
+    ('site', 'site__name'),
+    ('plot', 'replicate__plot__label'),
+    ('replicate', 'replicate__label'),
+]
+
+# rows written per output chunk
+ROWS_PER_CHUNK = 500
+
+# rows per Arrow record batch / Parquet row group
+ROWS_PER_BATCH = 10000
+
+
+def export_columns(dataset):
+    """
+    Returns the exported column names of a dataset, with the ORM lookups
+    they are read from.
+    """
+
+    model = DATASETS[dataset]['model']
+    columns = list(LOOKUP_COLUMNS)
+
+    for field in model._meta.concrete_fields:
+        if not field.primary_key and not field.is_relation:
+            columns.append((field.name, field.name))
+
+    return columns
+
+
+def export_rows(dataset, site_id=None, chunk_size=2000):
+    """
+    Returns an iterator over the value tuples of a dataset's rows.
+    """
+
+    model = DATASETS[dataset]['model']
+    queryset = model.objects.order_by('id')
+
+    if site_id is not None:
+        queryset = queryset.filter(site_id=site_id)
+
+    lookups = [lookup for column, lookup in export_columns(dataset)]
+
+    return queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    """
+    File-like object returning what is written to it, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def chunked(lines, empty):
+    """
+    Joins lines into chunks of ROWS_PER_CHUNK lines, with `empty` ('' or b'')
+    as the joiner.
+    """
+
+    chunk = []
+
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield empty.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield empty.join(chunk)
+
+
+def export_csv(dataset, site_id=None, chunk_size=2000):
+    """
+    Yields a dataset export as chunks of CSV text, header first.
+    """
+
+    writer = csv.writer(Echo())
+    columns = [column for column, lookup in export_columns(dataset)]
+
+    yield writer.writerow(columns)
+    yield from chunked((writer.writerow(row) for row in export_rows(dataset, site_id, chunk_size)), '')
+
+
+def export_ndjson(dataset, site_id=None, chunk_size=2000):
+    """
+    Yields a dataset export as chunks of newline-delimited JSON objects.
+    """
+
+    encode = get_json_encoder()
+    columns = [column for column, lookup in export_columns(dataset)]
+
+    yield from chunked(
+        (encode(dict(zip(columns, row))) + b'\n' for row in export_rows(dataset, site_id, chunk_size)),
+        b'',
+    )
+
+
+def lookup_field(model, lookup):
+    """
+    Returns the model field an ORM lookup like `replicate__label` reads.
+    """
+
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+
+    return model._meta.get_field(name)
+
+
+def arrow_type(field):
+    if isinstance(field, models.FloatField):
+        return pyarrow.float64()
+    if isinstance(field, models.IntegerField):
+        return pyarrow.int64()
+    if isinstance(field, models.DateField):
+        return pyarrow.date32()
+
+    return pyarrow.string()
+
+
+def arrow_schema(dataset):
+    model = DATASETS[dataset]['model']
+
+    return pyarrow.schema([
+        pyarrow.field(column, arrow_type(lookup_field(model, lookup)))
+        for column, lookup in export_columns(dataset)
+    ])
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Writable file keeping what is written until it is drained, for the
+    Arrow & Parquet writers.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_arrow_batches(open_writer, dataset, site_id=None, chunk_size=2000):
+    """
+    Yields a dataset export written by an Arrow writer, one record batch
+    (or Parquet row group) at a time. Columns keep their types, so floats
+    are contiguous float64 buffers with nulls in a validity bitmap.
+    """
+
+    schema = arrow_schema(dataset)
+    sink = ChunkSink()
+    writer = open_writer(sink, schema)
+
+    rows = export_rows(dataset, site_id, chunk_size)
+
+    while True:
+        batch = list(itertools.islice(rows, ROWS_PER_BATCH))
+        if not batch:
+            break
+
+        columns = [
+            pyarrow.array(values, type=field.type)
+            for values, field in zip(zip(*batch), schema)
+        ]
+        writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+
+        yield sink.drain()
+
+    writer.close()
+
+    yield sink.drain()
+
+
+EXPORTERS = {
+    'ndjson': export_ndjson,
+    'csv': export_csv,
+}
+
+if pyarrow is not None:
+    EXPORTERS['arrow'] = partial(export_arrow_batches, pyarrow.ipc.new_stream)
+    EXPORTERS['parquet'] = partial(export_arrow_batches, pyarrow.parquet.ParquetWriter)
@@ -0,0 +1,83 @@
+"""
+Long-format geochemistry values.
+
+Geochemistry stores every analyte of a sample in one wide row. When the
+GEOCHEMISTRY_VALUES setting is on, each non-null value is also kept as a
+GeochemistryValue row, indexed on (analyte, site), so queries for a few
+analytes read only those values. Rows are rewritten by model signals when
+a sample is saved, and per site after bulk loads.
+"""
+
+from django.conf import settings
+
+from artemis.models import Geochemistry, GeochemistryValue
+from artemis.summaries import elements
+
+
+# every analyte column of Geochemistry
+analytes = ['pH', 'pHCa', 'EC'] + elements
+
+
+def values_enabled():
+    return getattr(settings, 'GEOCHEMISTRY_VALUES', False)
+
+
+def sample_values(sample):
+    """
+    Returns the unsaved GeochemistryValue rows of a Geochemistry instance.
+    """
+
+    return [
+        GeochemistryValue(sample_id=sample.pk, site_id=sample.site_id, analyte=analyte, value=value)
+        for analyte in analytes
+        for value in [getattr(sample, analyte)]
+        if value is not None
+    ]
+
+
+def update_sample_values(sample):
+    """
+    Rewrites the values of a saved sample.
+    """
+
+    GeochemistryValue.objects.filter(sample_id=sample.pk).delete()
+    GeochemistryValue.objects.bulk_create(sample_values(sample))
+
+
+def refresh_site_values(site_id, batch_size=1000):
+    """
+    Rebuilds the values of a site from its Geochemistry rows.
+    """
+
+    GeochemistryValue.objects.filter(site_id=site_id).delete()
+
+    samples = Geochemistry.objects.filter(site_id=site_id).only('id', 'site_id', *analytes)
+    GeochemistryValue.objects.bulk_create(
+        (value for sample in samples.iterator() for value in sample_values(sample)),
+        batch_size=batch_size,
+    )
+
+
+def load_site_samples(site_id, fields, sample_analytes=elements):
+    """
+    Returns the Geochemistry samples of a site as dicts of the `fields`
+    lookups and `sample_analytes` values, like `.values()` on the wide
+    table. Analyte values are read from the long-format rows, and missing
+    ones are None.
+    """
+
+    samples = {
+        row['id']: dict(row, **dict.fromkeys(sample_analytes))
+        for row in Geochemistry.objects.filter(site=site_id).values('id', *fields).order_by('id')
+    }
+
+    values = GeochemistryValue.objects.filter(site=site_id, analyte__in=sample_analytes).values_list(
+        'sample_id', 'analyte', 'value'
+    )
+    for sample_id, analyte, value in values:
+        # skip samples created between the two queries
+        if sample_id in samples:
+            samples[sample_id][analyte] = value
+
+    return list(samples.values())
+
@@ -0,0 +1,119 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from artemis.depth_schemes import depth_label, depths, depths_time0
+from artemis.encoders import JSON_ENCODERS
+from artemis.summaries import elements
+
+
+def synthetic_geochemistry(time_labels, treatments):
+    """
+    Builds a payload shaped like the SiteGeochemistry response.
+    """
+
+    response = {}
+
+    for time in range(time_labels):
+        response[time] = {}
+
+        for treatment in range(treatments):
+            treatment_name = 'Treatment {}'.format(treatment)
+            response[time][treatment_name] = {}
+            response[time]['raw'] = {}
+
+            for element in elements:
+                response[time][treatment_name][element] = {
+                    depth_label(depth): random.random() * 1000 for depth in depths
+                }
+
+                if time == 0:
+                    response[time]['raw'][element] = {
+                        depth_label(depth): random.random() * 1000 for depth in depths_time0
+                    }
+
+    return response
+
+
+def synthetic_points(samples):
+    """
+    Builds a payload shaped like the SiteGeochemPoints response.
+    """
+
+    points = []
+
+    for sample in range(samples):
+        depth = random.choice(depths)
+
+        for element in elements:
+            points.append({
+                'element': [element],
+                'element_amount': random.random() * 1000 if random.random() > 0.1 else None,
+                'depth': [depth_label(depth)],
+                'time': random.randint(0, 4),
+                'treatment': random.randint(1, 4),
+                'replicate': random.randint(1, 48),
+            })
+
+    return {'points': points}
+
+
+def django_json_response(data):
+    # what JsonResponse does
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the JSON encoders available to the site data views on '
+        'synthetic site payloads, reporting encoding time and size.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-labels', type=int, default=5)
+        parser.add_argument('--treatments', type=int, default=4)
+        parser.add_argument('--samples', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+
+        random.seed(options['seed'])
+
+        payloads = {
+            'geochemistry': synthetic_geochemistry(options['time_labels'], options['treatments']),
+            'geochem-points': synthetic_points(options['samples']),
+        }
+
+        encoders = dict(JSON_ENCODERS)
+        encoders['JsonResponse'] = django_json_response
+
+        results = []
+
+        for payload_name, payload in payloads.items():
+            for encoder_name, encoder in encoders.items():
+                timings = []
+
+                for i in range(options['repeat']):
+                    start = time.perf_counter()
+                    content = encoder(payload)
+                    timings.append(time.perf_counter() - start)
+
+                result = {
+                    'payload': payload_name,
+                    'encoder': encoder_name,
+                    'bytes': len(content),
+                    'best_ms': min(timings) * 1000,
+                    'mean_ms': sum(timings) / len(timings) * 1000,
+                }
+                results.append(result)
+
+                self.stdout.write('{payload:<16} {encoder:<14} {bytes:>12} bytes {best_ms:>10.2f} ms best {mean_ms:>10.2f} ms mean'.format(**result))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
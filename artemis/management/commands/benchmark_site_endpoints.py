@@ -0,0 +1,284 @@
+import datetime
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from artemis.cache import invalidate_site
+from artemis.depth_schemes import depths, depths_time0
+from artemis.geochemistry_values import refresh_site_values, values_enabled
+from artemis.models import (
+    Extraction,
+    Geochemistry,
+    Mineralogy,
+    Plot,
+    Replicate,
+    Site,
+    Treatment,
+)
+from artemis.summaries import (
+    elements,
+    extraction_elements,
+    minerals,
+    refresh_site_summaries,
+    solvents,
+)
+
+
+def measurement(analytes, null_rate=0.05):
+    return {
+        analyte: None if random.random() < null_rate else random.random() * 1000
+        for analyte in analytes
+    }
+
+
+def seed_sites(sites, treatments, plots, replicates, time_labels):
+    """
+    Creates synthetic sites sampled like the real ones: unreplicated time 0
+    samples at the `depths_time0` depths, then one sample per replicate at
+    each of the `depths` at later time points. Returns the new site ids.
+    """
+
+    treatment_objects = [
+        Treatment.objects.create(label=i, description='Benchmark treatment {}'.format(i))
+        for i in range(treatments)
+    ]
+
+    site_ids = []
+
+    for site_number in range(sites):
+        site = Site.objects.create(
+            name='Benchmark site {}'.format(site_number),
+            latitude=32 + random.random(),
+            longitude=-110 + random.random(),
+        )
+        site_ids.append(site.id)
+
+        site_replicates = []
+        for plot_number in range(plots):
+            plot = Plot.objects.create(
+                site=site,
+                label=plot_number,
+                treatment=treatment_objects[plot_number % treatments],
+            )
+            site_replicates += Replicate.objects.bulk_create([
+                Replicate(plot=plot, label=replicate_number)
+                for replicate_number in range(replicates)
+            ])
+
+        # bulk_create doesn't return ids on every database
+        site_replicates = list(Replicate.objects.filter(plot__site=site))
+
+        geochemistry = []
+        mineralogy = []
+        extractions = []
+
+        for min_depth, max_depth in depths_time0:
+            sample = dict(site=site, time_label=0, min_depth=min_depth, max_depth=max_depth)
+            geochemistry.append(Geochemistry(**sample, **measurement(elements)))
+            mineralogy.append(Mineralogy(**sample, **measurement(minerals)))
+            for element in extraction_elements:
+                extractions.append(Extraction(element=element, **sample, **measurement(solvents)))
+
+        for time_label in range(1, time_labels):
+            for replicate in site_replicates:
+                for min_depth, max_depth in depths:
+                    sample = dict(
+                        site=site,
+                        replicate=replicate,
+                        time_label=time_label,
+                        min_depth=min_depth,
+                        max_depth=max_depth,
+                    )
+                    geochemistry.append(Geochemistry(**sample, **measurement(elements)))
+                    mineralogy.append(Mineralogy(**sample, **measurement(minerals)))
+                    for element in extraction_elements:
+                        extractions.append(Extraction(element=element, **sample, **measurement(solvents)))
+
+        Geochemistry.objects.bulk_create(geochemistry, batch_size=500)
+        Mineralogy.objects.bulk_create(mineralogy, batch_size=500)
+        Extraction.objects.bulk_create(extractions, batch_size=500)
+
+        # bulk writes don't send model signals
+        refresh_site_summaries(site.id)
+        if values_enabled():
+            refresh_site_values(site.id)
+
+    return site_ids
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a synthetic database at a configurable scale and measures wall '
+        'time, query count and peak memory of the site data and calculator '
+        'endpoints. The synthetic data is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, default=1)
+        parser.add_argument('--treatments', type=int, default=2)
+        parser.add_argument('--plots', type=int, default=4, help='Plots per site.')
+        parser.add_argument('--replicates', type=int, default=3, help='Replicates per plot.')
+        parser.add_argument('--time-labels', type=int, default=3, help='Time points, including time 0.')
+        parser.add_argument('--vector-length', type=int, default=200, help='Rows in the calculator vectors.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+
+        random.seed(options['seed'])
+        self.factory = RequestFactory()
+        self.repeat = options['repeat']
+
+        scale = {
+            key: options[key]
+            for key in ['sites', 'treatments', 'plots', 'replicates', 'time_labels', 'vector_length']
+        }
+
+        results = []
+        site_ids = []
+
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                site_ids = seed_sites(
+                    options['sites'],
+                    options['treatments'],
+                    options['plots'],
+                    options['replicates'],
+                    options['time_labels'],
+                )
+                self.stdout.write('Seeded {} sites in {:.2f}s'.format(len(site_ids), time.perf_counter() - start))
+
+                site_id = site_ids[0]
+                for path in [
+                    '/site-geochemistry/{}/',
+                    '/site-mineralogy/{}/',
+                    '/site-extractions/{}/',
+                    '/site-geochem-points/{}/',
+                    '/site-geochem-points/{}/?format=columnar',
+                    '/site-geochem-points/{}/?elements=Fe,As',
+                    '/site-geochem-cache/{}/',
+                ]:
+                    results.append(self.measure('GET', path.format(site_id)))
+
+                results += self.measure_calculators(site_id, options['vector_length'])
+
+                transaction.set_rollback(True)
+        finally:
+            # the rolled back site ids may be reused by real sites
+            for site_id in site_ids:
+                invalidate_site(site_id)
+
+        report = {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'scale': scale,
+            'repeat': self.repeat,
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def measure_calculators(self, site_id, vector_length):
+
+        amounts = list(
+            Geochemistry.objects.filter(site_id=site_id).exclude(Fe=None).values_list('Fe', flat=True)[:vector_length]
+        )
+        variable_vector = {
+            'x': [{'element_amount': amount} for amount in amounts],
+            'z': [{'element_amount': 2.5}],
+        }
+        max_length = len(amounts)
+
+        results = []
+
+        for path, latex in [
+            ('/latex-calculator', 'y=2x+z'),
+            ('/latex-calculator', 'y=\\log(x)+\\sum_{i=0}^{2}x_{i}'),
+            ('/simple-calculator', 'y=2*x^2+z'),
+        ]:
+            results.append(self.measure('GET', path, {
+                'latex': latex,
+                'solutionVar': 'y',
+                'maxVectorLength': max_length,
+                'variableVector': json.dumps(variable_vector),
+            }, label='{} {}'.format(path, latex)))
+
+        results.append(self.measure('POST', '/simple-calculator-batch', {
+            'variableVector': variable_vector,
+            'maxVectorLength': max_length,
+            'equations': [
+                {'latex': 'y=x*{}+z'.format(i), 'solutionVar': 'y'} for i in range(20)
+            ],
+        }, label='/simple-calculator-batch 20 equations'))
+
+        return results
+
+    def measure(self, method, path, data=None, label=None):
+        """
+        Calls the view routed for a path `repeat` times, reporting the wall
+        time, then once more for the query count and peak traced memory.
+        """
+
+        if method == 'POST':
+            request_path = path
+        else:
+            request_path = path.split('?')[0]
+
+        match = resolve(request_path)
+
+        def call():
+            if method == 'POST':
+                request = self.factory.post(path, json.dumps(data), content_type='application/json')
+            else:
+                request = self.factory.get(path, data)
+
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+
+            return response
+
+        timings = []
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+
+        # queries & memory are measured on a separate call, since tracing
+        # allocations slows the view down
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as captured:
+            response = call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        result = {
+            'endpoint': label or path,
+            'status': response.status_code,
+            'bytes': len(response.content),
+            'queries': len(captured),
+            'wall_ms_min': min(timings) * 1000,
+            'wall_ms_median': statistics.median(timings) * 1000,
+            'peak_memory_kb': peak / 1024,
+        }
+
+        self.stdout.write(
+            '{endpoint:<50.50} {status} {queries:>5} queries {wall_ms_min:>10.2f} ms min '
+            '{wall_ms_median:>10.2f} ms median {peak_memory_kb:>10.0f} KB peak'.format(**result)
+        )
+
+        return result
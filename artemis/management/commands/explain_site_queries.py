@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from artemis.api.api import SITE_DATA_VIEWS
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the queries behind a site data endpoint and prints the database '
+        'query plan for each one, to check which indexes they use.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('site_id', type=int)
+        parser.add_argument(
+            '--dataset',
+            choices=list(SITE_DATA_VIEWS),
+            default='geochemistry',
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Execute the queries and report actual timings (PostgreSQL only).',
+        )
+
+    def handle(self, *args, **options):
+
+        view = SITE_DATA_VIEWS[options['dataset']]()
+
+        with CaptureQueriesContext(connection) as captured:
+            view.get_site_data(options['site_id'])
+
+        if connection.vendor == 'postgresql':
+            explain = 'EXPLAIN ANALYZE ' if options['analyze'] else 'EXPLAIN '
+        elif connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+
+        self.stdout.write('{} queries for site {} {}\n'.format(
+            len(captured), options['site_id'], options['dataset']
+        ))
+
+        with connection.cursor() as cursor:
+            for query in captured.captured_queries:
+                self.stdout.write(query['sql'])
+
+                cursor.execute(explain + query['sql'])
+                for row in cursor.fetchall():
+                    self.stdout.write('    ' + ' '.join(str(column) for column in row))
+
+                self.stdout.write('')
@@ -0,0 +1,52 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from artemis.export import EXPORTERS
+from artemis.models import Site
+from artemis.summaries import DATASETS
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports the raw rows of the geochemistry, mineralogy or extraction '
+        'table as NDJSON, CSV, or with pyarrow installed Arrow IPC or Parquet, '
+        'streaming them so memory use does not grow with the number of rows. '
+        'CSV exports can be read by load_site_data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASETS))
+        parser.add_argument('--format', choices=list(EXPORTERS), default='csv')
+        parser.add_argument('--site', help='Only export the site with this name.')
+        parser.add_argument('--output', help='File to write to (defaults to stdout).')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched from the database at a time.',
+        )
+
+    def handle(self, *args, **options):
+
+        site_id = None
+        if options['site']:
+            site_id = Site.objects.filter(name=options['site']).values_list('id', flat=True).first()
+            if site_id is None:
+                raise CommandError('Unknown site "{}"'.format(options['site']))
+
+        chunks = EXPORTERS[options['format']](options['dataset'], site_id, options['chunk_size'])
+
+        start = time.time()
+
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                self.write(f, chunks)
+            self.stderr.write('Exported to {} in {:.2f}s'.format(options['output'], time.time() - start))
+        else:
+            self.write(sys.stdout.buffer, chunks)
+
+    def write(self, f, chunks):
+        for chunk in chunks:
+            f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
@@ -0,0 +1,284 @@
+import csv
+import datetime
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils.dateparse import parse_date
+
+from artemis.geochemistry_values import refresh_site_values, values_enabled
+from artemis.models import (
+    Extraction,
+    Geochemistry,
+    Mineralogy,
+    Replicate,
+    Site,
+)
+from artemis.summaries import schedule_summary_refresh
+
+
+DATASET_MODELS = {
+    'geochemistry': Geochemistry,
+    'mineralogy': Mineralogy,
+    'extractions': Extraction,
+}
+
+# columns identifying a sample, used to match rows that were loaded before
+KEY_FIELDS = ['site_id', 'replicate_id', 'time_label', 'min_depth', 'max_depth']
+
+# columns used to look up the site & replicate, not stored directly
+LOOKUP_COLUMNS = ['site', 'plot', 'replicate']
+
+EMPTY_VALUES = ['', 'na', 'n/a', 'nan', 'null', 'none', '-']
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def read_xlsx(path, sheet=None):
+    try:
+        import openpyxl
+    except ImportError:
+        raise CommandError('openpyxl is required to load .xlsx files.')
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    worksheet = workbook[sheet] if sheet else workbook.active
+
+    rows = worksheet.iter_rows(values_only=True)
+    header = [str(column).strip() if column is not None else '' for column in next(rows, [])]
+
+    for values in rows:
+        yield dict(zip(header, values))
+
+    workbook.close()
+
+
+def parse_label(value):
+    if is_empty(value):
+        return None
+
+    return int(float(value))
+
+
+def is_empty(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in EMPTY_VALUES)
+
+
+def parse_value(field, value):
+    """
+    Converts a spreadsheet cell to the python value for a model field.
+    """
+
+    if is_empty(value):
+        return None
+
+    if isinstance(field, models.FloatField):
+        return float(value)
+
+    if isinstance(field, models.IntegerField):
+        return int(float(value))
+
+    if isinstance(field, models.DateField):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return parse_date(str(value).strip())
+
+    return str(value).strip()
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads a CSV or XLSX lab export into the geochemistry, mineralogy or '
+        'extraction table. Rows are matched to sites by name and to '
+        'replicates by site name, plot label and replicate label. Rows that '
+        'match an existing sample are updated, so a file can be loaded again '
+        'safely. Site summaries are refreshed once the load commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASET_MODELS))
+        parser.add_argument('path')
+        parser.add_argument(
+            '--sheet',
+            help='Worksheet to read from an .xlsx file (defaults to the active sheet).',
+        )
+        parser.add_argument(
+            '--site',
+            help='Site name to use for rows without a site column.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+        )
+
+    def handle(self, *args, **options):
+
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError('File not found: {}'.format(path))
+
+        model = DATASET_MODELS[options['dataset']]
+        self.batch_size = options['batch_size']
+
+        # measurement & sample columns, by name
+        self.fields = {
+            field.name: field for field in model._meta.concrete_fields
+            if not field.primary_key and not field.is_relation
+        }
+        self.key_fields = KEY_FIELDS + (['element'] if model is Extraction else [])
+        # measurement columns found in the file, updated on existing samples
+        self.update_fields = set()
+
+        self.sites = dict(Site.objects.values_list('name', 'id'))
+        self.replicates = {
+            (site_name, plot_label, label): replicate_id
+            for replicate_id, site_name, plot_label, label in Replicate.objects.values_list(
+                'id', 'plot__site__name', 'plot__label', 'label'
+            )
+        }
+        # existing sample keys per site, loaded when a site is first seen
+        self.existing = {}
+        self.site_ids = set()
+        # sample keys loaded so far, so a repeated row is counted once
+        self.loaded = set()
+
+        if path.lower().endswith(('.xlsx', '.xlsm')):
+            rows = read_xlsx(path, options['sheet'])
+        else:
+            rows = read_csv(path)
+
+        start = time.time()
+        self.created = 0
+        self.updated = 0
+        # pending samples by key, so a repeated row replaces the pending one
+        self.to_create = {}
+        self.to_update = {}
+        self.unknown_columns = set()
+
+        with transaction.atomic():
+            for line, row in enumerate(rows, start=2):
+                try:
+                    instance = self.build_instance(model, row, options['site'])
+                except (ValueError, KeyError) as e:
+                    raise CommandError('Line {}: {}'.format(line, e))
+
+                if instance is None:
+                    continue
+
+                if instance.pk:
+                    self.to_update[self.sample_key(instance)] = instance
+                else:
+                    self.to_create[self.sample_key(instance)] = instance
+
+                if len(self.to_create) + len(self.to_update) >= self.batch_size:
+                    self.flush(model)
+
+            self.flush(model)
+
+            # bulk writes don't send model signals
+            for site_id in self.site_ids:
+                schedule_summary_refresh(site_id, [options['dataset']])
+                if model is Geochemistry and values_enabled():
+                    refresh_site_values(site_id)
+
+        elapsed = time.time() - start
+        total = self.created + self.updated
+
+        if self.unknown_columns:
+            self.stdout.write(self.style.WARNING(
+                'Ignored unknown columns: {}'.format(', '.join(sorted(self.unknown_columns)))
+            ))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Loaded {} rows ({} created, {} updated) in {:.2f}s ({:.0f} rows/s)'.format(
+                total, self.created, self.updated, elapsed, total / elapsed if elapsed else total
+            )
+        ))
+
+    def build_instance(self, model, row, default_site):
+        """
+        Builds an unsaved model instance from a spreadsheet row, with its pk
+        set if the sample was loaded before. Returns None for blank rows.
+        """
+
+        if all(is_empty(value) for value in row.values()):
+            return None
+
+        site_name = row.get('site')
+        site_name = default_site if is_empty(site_name) else str(site_name).strip()
+        if site_name is None:
+            raise ValueError('no site given')
+        if site_name not in self.sites:
+            raise ValueError('unknown site "{}"'.format(site_name))
+        site_id = self.sites[site_name]
+
+        replicate_id = None
+        if not is_empty(row.get('replicate')):
+            replicate_key = (site_name, parse_label(row.get('plot')), parse_label(row['replicate']))
+            if replicate_key not in self.replicates:
+                raise ValueError('unknown replicate {} in plot {} at site "{}"'.format(
+                    replicate_key[2], replicate_key[1], site_name
+                ))
+            replicate_id = self.replicates[replicate_key]
+
+        values = {'site_id': site_id, 'replicate_id': replicate_id}
+
+        for column, value in row.items():
+            if column in LOOKUP_COLUMNS:
+                continue
+            if column not in self.fields:
+                self.unknown_columns.add(column)
+                continue
+            values[column] = parse_value(self.fields[column], value)
+            if column not in self.key_fields:
+                self.update_fields.add(column)
+
+        instance = model(**values)
+        self.site_ids.add(site_id)
+        instance.pk = self.get_existing(model, site_id).get(self.sample_key(instance))
+
+        return instance
+
+    def sample_key(self, instance):
+        return tuple(getattr(instance, field_name) for field_name in self.key_fields)
+
+    def get_existing(self, model, site_id):
+        if site_id not in self.existing:
+            self.existing[site_id] = {
+                tuple(row[:-1]): row[-1]
+                for row in model.objects.filter(site_id=site_id).values_list(*self.key_fields, 'id')
+            }
+
+        return self.existing[site_id]
+
+    def flush(self, model):
+
+        # files with only key columns have nothing to update
+        if self.to_update and self.update_fields:
+            model.objects.bulk_update(self.to_update.values(), sorted(self.update_fields), batch_size=self.batch_size)
+
+        self.updated += len(self.to_update.keys() - self.loaded)
+        self.loaded.update(self.to_update)
+
+        if self.to_create:
+            created = model.objects.bulk_create(self.to_create.values(), batch_size=self.batch_size)
+            self.created += len(self.to_create.keys() - self.loaded)
+            self.loaded.update(self.to_create)
+
+            # later rows for the same samples update these ones
+            for instance in created:
+                if instance.pk:
+                    self.existing[instance.site_id][self.sample_key(instance)] = instance.pk
+                else:
+                    # the database doesn't return new primary keys, reload the site
+                    self.existing.pop(instance.site_id, None)
+
+        self.to_create = {}
+        self.to_update = {}
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from artemis.geochemistry_values import refresh_site_values
+from artemis.models import Site
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the long-format geochemistry values from the Geochemistry '
+        'table. Run after loading data without signals, or after turning '
+        'GEOCHEMISTRY_VALUES back on.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--site',
+            type=int,
+            action='append',
+            help='Site id to refresh (repeatable). Defaults to every site.',
+        )
+
+    def handle(self, *args, **options):
+
+        site_ids = options['site'] or Site.objects.values_list('id', flat=True)
+
+        for site_id in site_ids:
+            with transaction.atomic():
+                refresh_site_values(site_id)
+            self.stdout.write('Refreshed site {}'.format(site_id))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from artemis.models import Site
+from artemis.summaries import DATASETS, refresh_site_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the depth-binned summaries served by the site data '
+        'endpoints. Run after migrating, or after loading data without signals.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--site',
+            type=int,
+            action='append',
+            help='Site id to refresh (repeatable). Defaults to every site.',
+        )
+        parser.add_argument(
+            '--dataset',
+            choices=list(DATASETS),
+            action='append',
+        )
+
+    def handle(self, *args, **options):
+
+        site_ids = options['site'] or Site.objects.values_list('id', flat=True)
+
+        for site_id in site_ids:
+            refresh_site_summaries(site_id, options['dataset'])
+            self.stdout.write('Refreshed site {}'.format(site_id))
@@ -0,0 +1,109 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from artemis.api.api import SITE_DATA_VIEWS
+from artemis.cache import get_site_version, set_site_data
+from artemis.models import Site
+
+
+def init_worker():
+    import django
+
+    # set up Django in spawned workers; forked workers inherit it
+    django.setup()
+
+
+def warm_site(site_id, datasets):
+    """
+    Computes and caches the payloads of one site. Returns the time taken per
+    dataset, in seconds.
+    """
+
+    timings = {}
+
+    try:
+        for dataset in datasets:
+            start = time.perf_counter()
+            version = get_site_version(site_id)
+            data = SITE_DATA_VIEWS[dataset]().get_site_data(site_id)
+            set_site_data(dataset, site_id, data, version)
+            timings[dataset] = time.perf_counter() - start
+    finally:
+        # pool workers are reused; don't leave connections idle between sites
+        connections.close_all()
+
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        'Precomputes the cached payloads of every site, across a pool of '
+        'worker processes that each use their own database connection.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--site',
+            type=int,
+            action='append',
+            help='Site id to warm (repeatable). Defaults to every site.',
+        )
+        parser.add_argument(
+            '--dataset',
+            choices=list(SITE_DATA_VIEWS),
+            action='append',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes. 0 warms the cache in this process.',
+        )
+
+    def handle(self, *args, **options):
+
+        site_ids = options['site'] or list(Site.objects.values_list('id', flat=True))
+        datasets = options['dataset'] or list(SITE_DATA_VIEWS)
+        workers = options['workers']
+
+        backend = settings.CACHES['default']['BACKEND']
+        if workers and backend.endswith('LocMemCache'):
+            self.stdout.write(self.style.WARNING(
+                'The local memory cache is per process: payloads warmed by this '
+                'command are not visible to the web server processes.'
+            ))
+            workers = 0
+
+        start = time.perf_counter()
+
+        if not workers:
+            for site_id in site_ids:
+                self.report(site_id, warm_site(site_id, datasets))
+        else:
+            # workers must open their own connections, not share this one
+            connections.close_all()
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                futures = {
+                    executor.submit(warm_site, site_id, datasets): site_id
+                    for site_id in site_ids
+                }
+
+                for future in as_completed(futures):
+                    self.report(futures[future], future.result())
+
+        self.stdout.write(self.style.SUCCESS('Warmed {} sites in {:.2f}s'.format(
+            len(site_ids), time.perf_counter() - start
+        )))
+
+    def report(self, site_id, timings):
+        self.stdout.write('Site {}: {} ({:.1f} ms total)'.format(
+            site_id,
+            ', '.join('{} {:.1f} ms'.format(dataset, seconds * 1000) for dataset, seconds in timings.items()),
+            sum(timings.values()) * 1000,
+        ))
@@ -0,0 +1,166 @@
+"""
+In-process request metrics, exposed in the Prometheus text format.
+
+Metrics are kept per process, so each worker reports its own counters.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+
+# upper bounds of the request duration histogram, in seconds
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# metrics of the request being handled, set by RequestMetricsMiddleware
+current_request = ContextVar('current_request', default=None)
+
+
+class RequestMetrics:
+    """
+    Timings collected while handling one request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record_query(self, duration):
+        # async views run their queries on several threads at once
+        with self.lock:
+            self.queries += 1
+            self.query_time += duration
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper timing queries for the current request. It is
+    installed on every connection, so queries run on worker threads are
+    counted too.
+    """
+
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.record_query(time.perf_counter() - start)
+
+
+def record_site_cache(dataset, hit):
+    """
+    Records a site cache lookup, for the current request and the process.
+    """
+
+    request_metrics = current_request.get()
+    if request_metrics is not None:
+        if hit:
+            request_metrics.cache_hits += 1
+        else:
+            request_metrics.cache_misses += 1
+
+    registry.increment('artemis_site_cache_requests_total', {
+        'dataset': dataset,
+        'result': 'hit' if hit else 'miss',
+    })
+
+
+class Registry:
+    """
+    Thread-safe counters and histograms keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+
+        lines = []
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, dict(value, buckets=list(value['buckets'])))
+                for key, value in self.histograms.items()
+            )
+
+        typed = set()
+
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append('# TYPE {} counter'.format(name))
+                typed.add(name)
+            lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append('# TYPE {} histogram'.format(name))
+                typed.add(name)
+
+            for bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', format_value(bound)),)), count
+                ))
+            lines.append('{}_bucket{} {}'.format(
+                name, format_labels(labels + (('le', '+Inf'),)), histogram['count']
+            ))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels), format_value(histogram['sum'])))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    ) + '}'
+
+
+def format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+registry = Registry()
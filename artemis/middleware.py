@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+from artemis.metrics import RequestMetrics, current_request, registry
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the duration, SQL query count and SQL time of every request,
+    plus site cache hits and misses. They are returned in a Server-Timing
+    header and added to the process metrics served by the metrics view.
+
+    Queries are timed by the execute wrapper installed on each connection
+    (see `artemis.signals`), which records into the current request's
+    metrics.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(get_response):
+            # marks the middleware as async for the handler, like MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        start = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        self.finish(request, response, time.perf_counter() - start, request_metrics)
+
+        return response
+
+    async def __acall__(self, request):
+
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        start = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        self.finish(request, response, time.perf_counter() - start, request_metrics)
+
+        return response
+
+    def finish(self, request, response, duration, request_metrics):
+        self.add_server_timing(response, duration, request_metrics)
+        self.record(request, response, duration, request_metrics)
+
+    def add_server_timing(self, response, duration, request_metrics):
+        timings = [
+            'total;dur={:.1f}'.format(duration * 1000),
+            'db;dur={:.1f};desc="{} queries"'.format(request_metrics.query_time * 1000, request_metrics.queries),
+        ]
+
+        if request_metrics.cache_hits or request_metrics.cache_misses:
+            timings.append('cache;desc="{}"'.format('miss' if request_metrics.cache_misses else 'hit'))
+
+        response['Server-Timing'] = ', '.join(timings)
+
+    def record(self, request, response, duration, request_metrics):
+        # label by route, not path, to keep the number of series bounded
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.route if resolver_match else 'unmatched'
+
+        labels = {'route': route, 'method': request.method}
+
+        registry.increment('artemis_requests_total', dict(labels, status=response.status_code))
+        registry.observe('artemis_request_duration_seconds', labels, duration)
+        registry.increment('artemis_db_queries_total', labels, request_metrics.queries)
+        registry.increment('artemis_db_query_duration_seconds_total', labels, request_metrics.query_time)
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0003_cyverseaccount'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='extraction',
+            index=models.Index(fields=['site', 'element', 'time_label', 'min_depth'], name='extract_site_el_time_dep_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='geochemistry',
+            index=models.Index(fields=['site', 'time_label', 'min_depth'], name='geochem_site_time_depth_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mineralogy',
+            index=models.Index(fields=['site', 'time_label', 'min_depth'], name='mineral_site_time_depth_idx'),
+        ),
+    ]
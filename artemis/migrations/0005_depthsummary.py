@@ -0,0 +1,34 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0004_site_time_depth_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepthSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(choices=[('geochemistry', 'Geochemistry'), ('mineralogy', 'Mineralogy'), ('extractions', 'Extractions')], max_length=15)),
+                ('time_label', models.IntegerField()),
+                ('element', models.CharField(blank=True, max_length=15)),
+                ('analyte', models.CharField(max_length=15)),
+                ('depth_bin', models.CharField(max_length=15)),
+                ('raw', models.BooleanField(default=False)),
+                ('mean', models.FloatField(blank=True, null=True)),
+                ('n', models.IntegerField(default=0)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='artemis.site')),
+                ('treatment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='artemis.treatment')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='depthsummary',
+            index=models.Index(fields=['site', 'dataset'], name='summary_site_dataset_idx'),
+        ),
+    ]
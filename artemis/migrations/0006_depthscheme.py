@@ -0,0 +1,55 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# the depths the site views were hard-coded with
+DEFAULT_BINS = {
+    'later': [(0, 20), (20, 40), (40, 60), (60, 90)],
+    'time0': [(0, 5), (5, 15), (15, 25), (25, 35), (35, 38), (38, 54), (180, 183)],
+}
+
+
+def create_default_scheme(apps, schema_editor):
+    DepthScheme = apps.get_model('artemis', 'DepthScheme')
+    DepthBin = apps.get_model('artemis', 'DepthBin')
+
+    scheme = DepthScheme.objects.create(name='Default')
+    DepthBin.objects.bulk_create([
+        DepthBin(scheme=scheme, kind=kind, min_depth=min_depth, max_depth=max_depth)
+        for kind, bins in DEFAULT_BINS.items()
+        for min_depth, max_depth in bins
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0005_depthsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepthScheme',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128)),
+                ('site', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='depth_scheme', to='artemis.site')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DepthBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('later', 'Later time points'), ('time0', 'Time 0')], max_length=5)),
+                ('min_depth', models.IntegerField()),
+                ('max_depth', models.IntegerField()),
+                ('scheme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bins', to='artemis.depthscheme')),
+            ],
+            options={
+                'ordering': ['scheme', 'kind', 'min_depth'],
+            },
+        ),
+        migrations.RunPython(create_default_scheme, migrations.RunPython.noop),
+    ]
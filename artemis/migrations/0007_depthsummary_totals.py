@@ -0,0 +1,44 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:27
+
+from django.db import migrations, models
+
+
+GROUP_FIELDS = ['site', 'dataset', 'time_label', 'treatment', 'element', 'depth_bin', 'raw']
+
+
+def fill_totals(apps, schema_editor):
+    """
+    Derives the sums from the stored means. The sample count of a bin is
+    taken as its largest analyte count, which misses samples without any
+    values; refresh_summaries recomputes both exactly.
+    """
+
+    DepthSummary = apps.get_model('artemis', 'DepthSummary')
+
+    DepthSummary.objects.exclude(mean=None).update(total=models.F('mean') * models.F('n'))
+
+    groups = DepthSummary.objects.values(*GROUP_FIELDS).annotate(samples=models.Max('n')).order_by()
+    for group in groups:
+        samples = group.pop('samples')
+        DepthSummary.objects.filter(**group).update(samples=samples)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0006_depthscheme'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='depthsummary',
+            name='samples',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='depthsummary',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
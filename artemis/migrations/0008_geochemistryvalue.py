@@ -0,0 +1,32 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0007_depthsummary_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeochemistryValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('analyte', models.CharField(max_length=15)),
+                ('value', models.FloatField()),
+                ('sample', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analyte_values', to='artemis.geochemistry')),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='artemis.site')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='geochemistryvalue',
+            index=models.Index(fields=['analyte', 'site'], name='geochem_value_analyte_site_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='geochemistryvalue',
+            unique_together={('sample', 'analyte')},
+        ),
+    ]
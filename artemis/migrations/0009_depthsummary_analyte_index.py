@@ -0,0 +1,17 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0008_geochemistryvalue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='depthsummary',
+            index=models.Index(fields=['dataset', 'analyte', 'site'], name='summary_dataset_analyte_idx'),
+        ),
+    ]
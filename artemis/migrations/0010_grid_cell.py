@@ -0,0 +1,49 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:31
+
+import math
+
+from django.db import migrations, models
+
+
+# the grid of artemis.spatial when the column was added
+GRID_SIZE = 0.1
+GRID_ROWS = 1800
+GRID_COLUMNS = 3600
+
+
+def grid_cell(latitude, longitude):
+    row = min(max(int(math.floor((latitude + 90) / GRID_SIZE)), 0), GRID_ROWS - 1)
+    column = min(max(int(math.floor((longitude + 180) / GRID_SIZE)), 0), GRID_COLUMNS - 1)
+
+    return row * GRID_COLUMNS + column
+
+
+def fill_grid_cells(apps, schema_editor):
+    for model_name in ['Site', 'Replicate']:
+        model = apps.get_model('artemis', model_name)
+
+        located = model.objects.exclude(latitude=None).exclude(longitude=None)
+        for instance in located.only('id', 'latitude', 'longitude').iterator():
+            instance.grid_cell = grid_cell(instance.latitude, instance.longitude)
+            instance.save(update_fields=['grid_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0009_depthsummary_analyte_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='replicate',
+            name='grid_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='site',
+            name='grid_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0010_grid_cell'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='extraction',
+            name='extract_site_el_time_dep_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mineralogy',
+            name='mineral_site_time_depth_idx',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+KEY_FIELDS = ['site', 'dataset', 'time_label', 'treatment', 'element', 'analyte', 'depth_bin', 'raw']
+
+
+def remove_duplicate_summaries(apps, schema_editor):
+    """
+    Keeps one row per summary key, so the unique constraints of the next
+    migration can be added. Summaries are computed by the summary code, not
+    here: run `manage.py refresh_summaries` after migrating.
+    """
+
+    DepthSummary = apps.get_model('artemis', 'DepthSummary')
+
+    duplicates = DepthSummary.objects.values(*KEY_FIELDS).annotate(
+        keep=models.Min('id'), count=models.Count('id')
+    ).filter(count__gt=1).order_by()
+
+    for duplicate in duplicates:
+        keep = duplicate.pop('keep')
+        duplicate.pop('count')
+        DepthSummary.objects.filter(**duplicate).exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0011_remove_unused_measurement_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_summaries, migrations.RunPython.noop),
+    ]
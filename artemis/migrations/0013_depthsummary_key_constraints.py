@@ -0,0 +1,21 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artemis', '0012_fill_depth_summaries'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='depthsummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('treatment__isnull', False)), fields=('site', 'dataset', 'time_label', 'treatment', 'element', 'analyte', 'depth_bin', 'raw'), name='summary_key_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='depthsummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('treatment__isnull', True)), fields=('site', 'dataset', 'time_label', 'element', 'analyte', 'depth_bin', 'raw'), name='summary_key_all_treatments_unique'),
+        ),
+    ]
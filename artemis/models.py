@@ -1,5 +1,8 @@
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from artemis.deletion import bulk_delete
 
 
 class CyVerseAccount(models.Model):
@@ -25,17 +28,57 @@ class CyVerseAccount(models.Model):
         return self.user.username
 
 
-class Treatment(models.Model):
+class BulkDeleteQuerySet(models.QuerySet):
+
+    def delete(self):
+        with bulk_delete():
+            return super().delete()
+
+
+class CascadingModel(models.Model):
+    """
+    A model whose rows take measurements with them when deleted.
+    """
+
+    objects = BulkDeleteQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def delete(self, *args, **kwargs):
+        with bulk_delete():
+            return super().delete(*args, **kwargs)
+
+
+class MeasurementModel(models.Model):
+    """
+    A measurement table. Saves run in one transaction with the signal
+    handlers that update the site's summaries.
+    """
+
+    objects = BulkDeleteQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class Treatment(CascadingModel):
 
     label = models.IntegerField()
     description = models.CharField(max_length=128)
 
 
-class Site(models.Model):
+class Site(CascadingModel):
 
     name = models.CharField(max_length=128)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # cell of the coordinates in the artemis.spatial grid, set on save
+    grid_cell = models.IntegerField(blank=True, null=True, db_index=True, editable=False)
 
     def __unicode__(self):
         return u'%s' % self.name
@@ -44,23 +87,25 @@ class Site(models.Model):
         return self.name
 
 
-class Plot(models.Model):
+class Plot(CascadingModel):
 
     site = models.ForeignKey(Site, on_delete=models.CASCADE)
     label = models.IntegerField()
     treatment = models.ForeignKey(Treatment, on_delete=models.CASCADE)
 
 
-class Replicate(models.Model):
+class Replicate(CascadingModel):
 
     plot = models.ForeignKey(Plot, on_delete=models.CASCADE)
     label = models.IntegerField()
 
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # cell of the coordinates in the artemis.spatial grid, set on save
+    grid_cell = models.IntegerField(blank=True, null=True, db_index=True, editable=False)
     
 
-class Mineralogy(models.Model):
+class Mineralogy(MeasurementModel):
 
     site = models.ForeignKey(Site, on_delete=models.CASCADE)
     replicate = models.ForeignKey(Replicate, on_delete=models.CASCADE, blank=True, null=True)
@@ -83,7 +128,7 @@ class Mineralogy(models.Model):
     siderite = models.FloatField(blank=True, null=True)
     amorphous = models.FloatField(blank=True, null=True)
   
-class Geochemistry(models.Model):
+class Geochemistry(MeasurementModel):
 
     # Geochemistry can be associated with a Site OR Replicate
     site = models.ForeignKey(Site, on_delete=models.CASCADE)
@@ -161,8 +206,32 @@ class Geochemistry(models.Model):
     Zn = models.FloatField(blank=True, null=True)
     Zr = models.FloatField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'time_label', 'min_depth'], name='geochem_site_time_depth_idx'),
+        ]
 
-class Extraction(models.Model):
+
+class GeochemistryValue(models.Model):
+    """
+    Long-format copy of a Geochemistry value: one row per sample and
+    analyte with a value. Rows are maintained by artemis.geochemistry_values.
+    """
+
+    sample = models.ForeignKey(Geochemistry, on_delete=models.CASCADE, related_name='analyte_values')
+    # the sample's site, so values can be filtered by site without a join
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    analyte = models.CharField(max_length=15)
+    value = models.FloatField()
+
+    class Meta:
+        unique_together = [('sample', 'analyte')]
+        indexes = [
+            models.Index(fields=['analyte', 'site'], name='geochem_value_analyte_site_idx'),
+        ]
+
+
+class Extraction(MeasurementModel):
 
     site = models.ForeignKey(Site, on_delete=models.CASCADE)
     replicate = models.ForeignKey(Replicate, on_delete=models.CASCADE, blank=True, null=True)
@@ -184,4 +253,117 @@ class Extraction(models.Model):
     AAO = models.FloatField(blank=True, null=True)
     AAO_sd = models.FloatField(blank=True, null=True)
     CDB = models.FloatField(blank=True, null=True)
-    CDB_sd = models.FloatField(blank=True, null=True)
\ No newline at end of file
+    CDB_sd = models.FloatField(blank=True, null=True)
+
+
+class DepthSummary(models.Model):
+    """
+    Precomputed depth-binned average of one analyte at a site, as served by
+    the site data endpoints. Rows are maintained by artemis.summaries.
+    """
+
+    DATASET_CHOICES = [
+        ('geochemistry', 'Geochemistry'),
+        ('mineralogy', 'Mineralogy'),
+        ('extractions', 'Extractions'),
+    ]
+
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    dataset = models.CharField(max_length=15, choices=DATASET_CHOICES)
+    time_label = models.IntegerField()
+    # null when the average covers every treatment
+    treatment = models.ForeignKey(Treatment, on_delete=models.CASCADE, blank=True, null=True)
+    # extracted element, for extractions only
+    element = models.CharField(max_length=15, blank=True)
+    analyte = models.CharField(max_length=15)
+
+    depth_bin = models.CharField(max_length=15)
+    # raw rows hold a single sampled depth instead of a depth bin
+    raw = models.BooleanField(default=False)
+
+    mean = models.FloatField(blank=True, null=True)
+    n = models.IntegerField(default=0)
+    # running sum of the n non-null values, and number of samples in the
+    # bin, kept up to date as measurements are saved & deleted
+    total = models.FloatField(default=0)
+    samples = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'dataset'], name='summary_site_dataset_idx'),
+            # cross-site comparisons
+            models.Index(fields=['dataset', 'analyte', 'site'], name='summary_dataset_analyte_idx'),
+        ]
+        # one row per summary key; nulls are distinct in unique constraints,
+        # so averages over every treatment get their own constraint
+        constraints = [
+            models.UniqueConstraint(
+                fields=['site', 'dataset', 'time_label', 'treatment', 'element', 'analyte', 'depth_bin', 'raw'],
+                condition=models.Q(treatment__isnull=False),
+                name='summary_key_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['site', 'dataset', 'time_label', 'element', 'analyte', 'depth_bin', 'raw'],
+                condition=models.Q(treatment__isnull=True),
+                name='summary_key_all_treatments_unique',
+            ),
+        ]
+
+
+class DepthScheme(models.Model):
+    """
+    The depth bins a site's measurements are averaged into. The scheme
+    without a site is the default for sites without their own.
+    """
+
+    name = models.CharField(max_length=128)
+    site = models.OneToOneField(Site, on_delete=models.CASCADE, blank=True, null=True, related_name='depth_scheme')
+
+    def __str__(self):
+        return self.name
+
+
+class DepthBin(models.Model):
+    """
+    A depth interval of a depth scheme, in cm. Samples are assigned to the
+    bin they overlap most.
+    """
+
+    # later time points are binned per treatment, time 0 samples are shown
+    # raw at their sampled depths and folded into the later bins
+    KIND_CHOICES = [
+        ('later', 'Later time points'),
+        ('time0', 'Time 0'),
+    ]
+
+    scheme = models.ForeignKey(DepthScheme, on_delete=models.CASCADE, related_name='bins')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    min_depth = models.IntegerField()
+    max_depth = models.IntegerField()
+
+    # the admin checks the submitted bins of a scheme together instead
+    check_saved_overlaps = True
+
+    class Meta:
+        ordering = ['scheme', 'kind', 'min_depth']
+
+    def __str__(self):
+        return '{}-{}'.format(self.min_depth, self.max_depth)
+
+    def clean(self):
+        if self.min_depth >= self.max_depth:
+            raise ValidationError('The max depth must be greater than the min depth.')
+
+        if not self.check_saved_overlaps:
+            return
+
+        # bins of a kind must not overlap
+        overlapping = DepthBin.objects.filter(
+            scheme_id=self.scheme_id,
+            kind=self.kind,
+            min_depth__lt=self.max_depth,
+            max_depth__gt=self.min_depth,
+        ).exclude(pk=self.pk).first()
+
+        if overlapping is not None:
+            raise ValidationError('Overlaps the {} bin.'.format(overlapping))
@@ -26,11 +26,13 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'django_filters',
     'corsheaders',
     'artemis'
 ]
 
 MIDDLEWARE = [
+    'artemis.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -117,3 +119,33 @@ REST_FRAMEWORK = {
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+
+# Site data cache
+# Cached site payloads are invalidated by model signals when their data
+# changes, so by default they never expire.
+
+SITE_CACHE_TIMEOUT = None
+
+# Compressed payloads larger than this many bytes are not cached, and are
+# recomputed on every request. memcached refuses items over 1 MB by default.
+
+SITE_CACHE_MAX_SIZE = 1000 * 1000
+
+# Request metrics
+# Addresses allowed to scrape the in-process metrics at /metrics/.
+
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Async site views
+# Threads running the database & cache calls of the async site views, per
+# process. Each thread may hold a database connection.
+
+SITE_QUERY_THREADS = 8
+
+# Long-format geochemistry
+# Keep a GeochemistryValue row per sample & analyte, and serve geochemistry
+# points filtered with ?elements= from them. Off by default: reading the
+# wide rows was faster on the benchmarked sites. Run
+# refresh_geochemistry_values after turning it on.
+
+GEOCHEMISTRY_VALUES = False
@@ -1,3 +1,5 @@
+import os
+
 from .base import *
 
 # Quick-start development settings - unsuitable for production
@@ -25,9 +27,33 @@ DATABASES = {
     }
 }
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '/var/tmp/django_cache',
+# The site data cache is shared by every web process, so that every web host
+# sees the same payloads and invalidations. It is memcached at
+# MEMCACHED_LOCATION (host:port, comma separated for several servers); set it
+# to an empty string to cache on this host's disk instead, e.g. for a single
+# development server.
+#
+# memcached refuses items over 1 MB by default. Site payloads are stored
+# gzip-compressed, which keeps most geochem points payloads well below that;
+# compressed payloads over SITE_CACHE_MAX_SIZE bytes are not cached. Raise
+# both (e.g. `memcached -I 4m`) for sites with very many samples.
+
+MEMCACHED_LOCATION = os.environ.get('MEMCACHED_LOCATION', '127.0.0.1:11211')
+
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MEMCACHED_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': '/var/tmp/django_cache',
+        }
     }
-}
\ No newline at end of file
+
+# gzip level of the cached site payloads
+SITE_CACHE_COMPRESS_LEVEL = 6
\ No newline at end of file
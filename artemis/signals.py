@@ -0,0 +1,203 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from artemis.cache import invalidate_site_on_commit
+from artemis.deletion import in_bulk_delete
+from artemis.depth_schemes import invalidate_depth_schemes
+from artemis.geochemistry_values import update_sample_values, values_enabled
+from artemis.models import (
+  DepthBin,
+  DepthScheme,
+  Extraction,
+  Geochemistry,
+  Mineralogy,
+  Plot,
+  Replicate,
+  Site,
+  Treatment,
+)
+from artemis.metrics import record_query
+from artemis.spatial import grid_cell
+from artemis.summaries import (
+  get_summary_row,
+  schedule_summary_refresh,
+  update_measurement_summaries,
+)
+
+
+MEASUREMENT_DATASETS = {
+    Geochemistry: 'geochemistry',
+    Mineralogy: 'mineralogy',
+    Extraction: 'extractions',
+}
+
+
+@receiver(connection_created)
+def add_query_metrics(sender, connection, **kwargs):
+    # connections are reopened on the same wrapper, which keeps its wrappers
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(pre_save, sender=Geochemistry)
+@receiver(pre_delete, sender=Geochemistry)
+@receiver(pre_save, sender=Mineralogy)
+@receiver(pre_delete, sender=Mineralogy)
+@receiver(pre_save, sender=Extraction)
+@receiver(pre_delete, sender=Extraction)
+def remember_measurement(sender, instance, signal, **kwargs):
+    # the stored values, to take out of the summaries after the change;
+    # bulk deletes refresh the summaries instead
+    instance._summary_row = None
+    if instance.pk is not None and not (signal is pre_delete and in_bulk_delete()):
+        instance._summary_row = get_summary_row(MEASUREMENT_DATASETS[sender], instance.pk)
+
+
+@receiver(post_save, sender=Geochemistry)
+@receiver(post_save, sender=Mineralogy)
+@receiver(post_save, sender=Extraction)
+def update_saved_measurement(sender, instance, **kwargs):
+    dataset = MEASUREMENT_DATASETS[sender]
+    removed = getattr(instance, '_summary_row', None)
+
+    # a measurement moved to another site changes both sites
+    site_ids = {instance.site_id}
+    if removed is not None:
+        site_ids.add(removed[0])
+
+    for site_id in site_ids:
+        invalidate_site_on_commit(site_id)
+
+    update_measurement_summaries(
+        dataset,
+        removed=removed,
+        added=get_summary_row(dataset, instance.pk),
+    )
+
+
+@receiver(post_save, sender=Geochemistry)
+def update_geochemistry_values(sender, instance, **kwargs):
+    # deleted samples lose their values by cascade
+    if values_enabled():
+        update_sample_values(instance)
+
+
+@receiver(post_delete, sender=Geochemistry)
+@receiver(post_delete, sender=Mineralogy)
+@receiver(post_delete, sender=Extraction)
+def update_deleted_measurement(sender, instance, **kwargs):
+    if in_bulk_delete():
+        # the refresh also invalidates the site
+        schedule_summary_refresh(instance.site_id, [MEASUREMENT_DATASETS[sender]])
+        return
+
+    invalidate_site_on_commit(instance.site_id)
+    update_measurement_summaries(
+        MEASUREMENT_DATASETS[sender],
+        removed=getattr(instance, '_summary_row', None),
+    )
+
+
+@receiver(pre_save, sender=Plot)
+def remember_plot_site(sender, instance, **kwargs):
+    # the stored site & treatment; the stored site loses the plot if it moves
+    instance._stored_site_id = instance._stored_treatment_id = None
+    if instance.pk is not None:
+        instance._stored_site_id, instance._stored_treatment_id = Plot.objects.filter(pk=instance.pk).values_list(
+            'site_id', 'treatment_id'
+        ).first() or (None, None)
+
+
+@receiver(post_save, sender=Plot)
+@receiver(post_delete, sender=Plot)
+def update_plot_site(sender, instance, signal, created=False, **kwargs):
+    stored_site_id = getattr(instance, '_stored_site_id', None)
+    site_ids = {instance.site_id, stored_site_id} - {None}
+
+    # plot treatments decide how later time points are averaged; a new plot
+    # has no measurements yet
+    refresh = signal is post_delete or not created and (
+        (stored_site_id, getattr(instance, '_stored_treatment_id', None)) != (instance.site_id, instance.treatment_id)
+    )
+
+    for site_id in site_ids:
+        invalidate_site_on_commit(site_id)
+        if refresh:
+            schedule_summary_refresh(site_id)
+
+
+@receiver(pre_save, sender=Replicate)
+def remember_replicate_site(sender, instance, **kwargs):
+    # the stored plot & its site, which loses the replicate if it moves
+    instance._stored_plot_id = instance._stored_site_id = None
+    if instance.pk is not None:
+        instance._stored_plot_id, instance._stored_site_id = Replicate.objects.filter(pk=instance.pk).values_list(
+            'plot_id', 'plot__site_id'
+        ).first() or (None, None)
+
+
+@receiver(post_save, sender=Replicate)
+@receiver(post_delete, sender=Replicate)
+def update_replicate_site(sender, instance, signal, created=False, **kwargs):
+    # the plot may already be gone when the replicate is removed by a
+    # cascading delete; the plot's own signal covers that case
+    site_ids = set(Plot.objects.filter(id=instance.plot_id).values_list('site_id', flat=True))
+    site_ids |= {getattr(instance, '_stored_site_id', None)} - {None}
+
+    # the replicate's plot decides its measurements' treatment; other
+    # changes, such as its coordinates, are only in the cached payloads
+    refresh = signal is post_delete or not created and getattr(instance, '_stored_plot_id', None) != instance.plot_id
+
+    for site_id in site_ids:
+        invalidate_site_on_commit(site_id)
+        if refresh:
+            schedule_summary_refresh(site_id)
+
+
+@receiver(pre_save, sender=Site)
+@receiver(pre_save, sender=Replicate)
+def update_grid_cell(sender, instance, **kwargs):
+    # bulk writes skip this; save each row to re-index moved locations
+    instance.grid_cell = grid_cell(instance.latitude, instance.longitude)
+
+
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+def invalidate_treatment_site_cache(sender, instance, **kwargs):
+    # treatment descriptions are used as keys in the site payloads
+    site_ids = Plot.objects.filter(treatment_id=instance.id).values_list('site_id', flat=True).distinct()
+
+    for site_id in site_ids:
+        invalidate_site_on_commit(site_id)
+
+
+def update_depth_scheme_sites(site_id):
+    # processes may have loaded the old scheme until the change commits
+    transaction.on_commit(invalidate_depth_schemes)
+
+    # the default scheme applies to every site without its own
+    if site_id is None:
+        site_ids = Site.objects.filter(depth_scheme=None).values_list('id', flat=True)
+    else:
+        site_ids = [site_id]
+
+    for site_id in site_ids:
+        schedule_summary_refresh(site_id)
+
+
+@receiver(post_save, sender=DepthScheme)
+@receiver(post_delete, sender=DepthScheme)
+def update_depth_scheme(sender, instance, **kwargs):
+    update_depth_scheme_sites(instance.site_id)
+
+
+@receiver(post_save, sender=DepthBin)
+@receiver(post_delete, sender=DepthBin)
+def update_depth_bin(sender, instance, **kwargs):
+    site_ids = DepthScheme.objects.filter(id=instance.scheme_id).values_list('site_id', flat=True)
+
+    # bins deleted with their scheme are handled by the scheme
+    for site_id in site_ids:
+        update_depth_scheme_sites(site_id)
@@ -0,0 +1,125 @@
+"""
+Grid index for the coordinates of sites and replicates.
+
+Each located row stores the cell of a fixed latitude/longitude grid in an
+indexed `grid_cell` column. Cells are numbered row by row, so a bounding
+box covers one contiguous range of cells per grid row. Box and radius
+queries first select those ranges through the index, then check the exact
+coordinates of the candidates.
+"""
+
+import math
+
+from django.db.models import F, Q
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+
+# size of a grid cell in degrees, about 11 km of latitude
+GRID_SIZE = 0.1
+GRID_ROWS = int(round(180 / GRID_SIZE))
+GRID_COLUMNS = int(round(360 / GRID_SIZE))
+
+# boxes spanning more cell ranges than this are filtered on coordinates only
+MAX_GRID_RANGES = 64
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def grid_row(latitude):
+    return min(max(int(math.floor((latitude + 90) / GRID_SIZE)), 0), GRID_ROWS - 1)
+
+
+def grid_column(longitude):
+    return min(max(int(math.floor((longitude + 180) / GRID_SIZE)), 0), GRID_COLUMNS - 1)
+
+
+def grid_cell(latitude, longitude):
+    """
+    Returns the grid cell of a location, or None when it has no coordinates.
+    """
+
+    if latitude is None or longitude is None:
+        return None
+
+    return grid_row(latitude) * GRID_COLUMNS + grid_column(longitude)
+
+
+def bbox_filter(west, south, east, north):
+    """
+    Returns a filter for the rows within a bounding box. A box with `west`
+    greater than `east` crosses the antimeridian.
+    """
+
+    if west <= east:
+        longitudes = Q(longitude__gte=west, longitude__lte=east)
+        column_ranges = [(grid_column(west), grid_column(east))]
+    else:
+        longitudes = Q(longitude__gte=west) | Q(longitude__lte=east)
+        column_ranges = [(grid_column(west), GRID_COLUMNS - 1), (0, grid_column(east))]
+
+    rows = range(grid_row(south), grid_row(north) + 1)
+
+    bounds = Q(latitude__gte=south, latitude__lte=north) & longitudes
+
+    if len(rows) * len(column_ranges) > MAX_GRID_RANGES:
+        return bounds
+
+    cells = Q()
+    for row in rows:
+        for first, last in column_ranges:
+            cells |= Q(grid_cell__range=(row * GRID_COLUMNS + first, row * GRID_COLUMNS + last))
+
+    return cells & bounds
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """
+    Returns the (west, south, east, north) box around a circle.
+    """
+
+    degrees = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south = max(latitude - degrees, -90.0)
+    north = min(latitude + degrees, 90.0)
+
+    # near the poles the circle spans every longitude
+    cos_latitude = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_latitude <= 0 or degrees / cos_latitude >= 180:
+        return -180.0, south, 180.0, north
+
+    west = longitude - degrees / cos_latitude
+    east = longitude + degrees / cos_latitude
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+
+    return west, south, east, north
+
+
+def distance_km(latitude, longitude):
+    """
+    Returns an expression for the great-circle distance of a row from a
+    location, in km (haversine formula).
+    """
+
+    latitude_delta = Radians(F('latitude')) - math.radians(latitude)
+    longitude_delta = Radians(F('longitude')) - math.radians(longitude)
+
+    a = (
+        Power(Sin(latitude_delta / 2), 2) +
+        math.cos(math.radians(latitude)) * Cos(Radians(F('latitude'))) * Power(Sin(longitude_delta / 2), 2)
+    )
+
+    # rounding can take antipodal points just past 1
+    return 2 * EARTH_RADIUS_KM * ASin(Least(Sqrt(a), 1.0))
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    Filters a queryset to the rows within `radius_km` of a location,
+    nearest first.
+    """
+
+    return queryset.filter(bbox_filter(*radius_bbox(latitude, longitude, radius_km))).annotate(
+        distance=distance_km(latitude, longitude)
+    ).filter(distance__lte=radius_km).order_by('distance')
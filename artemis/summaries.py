@@ -0,0 +1,430 @@
+"""
+Depth-binned averages for the site data endpoints.
+
+Averages are precomputed into DepthSummary rows, one per site, dataset, time
+point, treatment, analyte and depth bin. They are recomputed for a site when
+its measurements change, so the endpoints only read summary rows.
+"""
+
+import threading
+
+from django.db import connection, transaction
+from django.db.models import CharField, Q, Value
+
+from artemis.binning import Measurements, depth_bin_means
+from artemis.cache import invalidate_site_on_commit
+from artemis.depth_schemes import get_depth_scheme, load_depth_scheme
+from artemis.models import (
+  DepthSummary,
+  Extraction,
+  Geochemistry,
+  Mineralogy,
+  Plot,
+  Site,
+)
+
+
+elements = [
+    'Ag',
+    'Al',
+    'As',
+    'Au',
+    'Ba',
+    'Be',
+    'Bi',
+    'Br',
+    'Ca',
+    'Cd',
+    'Ce',
+    'Co',
+    'Cr',
+    'Cs',
+    'Cu',
+    'Dy',
+    'Er',
+    'Eu',
+    'Fe',
+    'Ga',
+    'Gd',
+    'Ge',
+    'Hf',
+    'Ho',
+    'In',
+    'Ir',
+    'K',
+    'La',
+    'Lu',
+    'Mg',
+    'Mn',
+    'Mo',
+    'Na',
+    'Nb',
+    'Nd',
+    'Ni',
+    'P',
+    'Pb',
+    'Pr',
+    'Rb',
+    'S',
+    'Sb',
+    'Sc',
+    'Se',
+    'Si',
+    'Sm',
+    'Sn',
+    'Sr',
+    'Ta',
+    'Tb',
+    'Th',
+    'Ti',
+    'Tl',
+    'Tm',
+    'U',
+    'V',
+    'W',
+    'Y',
+    'Yb',
+    'Zn',
+    'Zr',
+]
+
+minerals = [
+    'quartz',
+    'plagioclase',
+    'illite',
+    'chlorite',
+    'kaolinite',
+    'pyrite',
+    'gypsum',
+    'jarosite',
+    'melanternite',
+    'ankerite',
+    'siderite',
+    'amorphous',
+]
+
+extraction_elements = [
+    'Al',
+    'As',
+    'Ca',
+    'Cr',
+    'Fe',
+    'K',
+    'Mg',
+    'Mn',
+    'Pb',
+    'Ti',
+    'Zn',
+]
+
+solvents = [
+    'H20',
+    'AmNO3',
+    'AAc',
+    'PO4',
+    'AAO',
+    'CDB',
+]
+
+DATASETS = {
+    'geochemistry': {
+        'model': Geochemistry,
+        'analytes': elements,
+        # later time points are averaged per treatment
+        'by_treatment': True,
+        'by_element': False,
+    },
+    'mineralogy': {
+        'model': Mineralogy,
+        'analytes': minerals,
+        'by_treatment': True,
+        'by_element': False,
+    },
+    'extractions': {
+        'model': Extraction,
+        'analytes': solvents,
+        'by_treatment': False,
+        'by_element': True,
+    },
+}
+
+
+def site_treatment_ids(site_id, dataset):
+    """
+    Returns the treatments later time points are averaged by, or None for
+    datasets that aren't averaged by treatment.
+    """
+
+    if not DATASETS[dataset]['by_treatment']:
+        return None
+
+    return set(Plot.objects.filter(site_id=site_id).values_list('treatment', flat=True))
+
+
+def compute_site_summaries(site_id, dataset):
+    """
+    Computes the unsaved DepthSummary rows for a site dataset. The site's
+    measurements are loaded with one query and binned with NumPy, into the
+    bins of the site's depth scheme.
+    """
+
+    config = DATASETS[dataset]
+    measurements = Measurements.load(
+        config['model'].objects.filter(site=site_id),
+        config['analytes'],
+        by_element=config['by_element'],
+    )
+
+    return [
+        DepthSummary(site_id=site_id, dataset=dataset, **summary._asdict())
+        for summary in depth_bin_means(
+            measurements, load_depth_scheme(site_id), site_treatment_ids(site_id, dataset)
+        )
+    ]
+
+
+def lock_site(site_id):
+    """
+    Locks the site row until the end of the transaction, so concurrent
+    writes to the site's summaries are applied one after another.
+    """
+
+    list(Site.objects.select_for_update().filter(pk=site_id).values_list('pk', flat=True))
+
+
+def refresh_site_summaries(site_id, datasets=None):
+    """
+    Recomputes the summaries of a site, for every dataset or the given ones.
+    """
+
+    datasets = datasets or list(DATASETS)
+
+    with transaction.atomic():
+        lock_site(site_id)
+
+        for dataset in datasets:
+            summaries = compute_site_summaries(site_id, dataset)
+            DepthSummary.objects.filter(site_id=site_id, dataset=dataset).delete()
+            DepthSummary.objects.bulk_create(summaries, batch_size=1000)
+
+    invalidate_site_on_commit(site_id)
+
+
+def get_summary_row(dataset, pk):
+    """
+    Returns the values of a measurement that its summaries are computed
+    from, with its site id first, or None if it doesn't exist.
+    """
+
+    config = DATASETS[dataset]
+    lookups = Measurements.lookups(config['analytes'], config['by_element'])
+
+    return config['model'].objects.filter(pk=pk).values_list('site_id', *lookups).first()
+
+
+def update_measurement_summaries(dataset, removed=None, added=None):
+    """
+    Applies the change of one measurement to the summaries of its site,
+    given its summary row before and after the change (None when it was
+    created or deleted). Only the bins it falls in are recomputed, so a
+    change costs a few queries instead of a refresh of the whole site.
+    """
+
+    site_ids = {row[0] for row in [removed, added] if row is not None}
+
+    for site_id in site_ids:
+        update_site_summaries(
+            site_id,
+            dataset,
+            [row[1:] for row in [removed] if row is not None and row[0] == site_id],
+            [row[1:] for row in [added] if row is not None and row[0] == site_id],
+        )
+
+
+def update_site_summaries(site_id, dataset, removed_rows, added_rows):
+    """
+    Recomputes the summaries of the bins the removed & added rows fall in,
+    from the rows of their time points only. The bins are recomputed
+    rather than adjusted by the change, so no rounding error builds up in
+    their sums.
+    """
+
+    # an edit that left the summarized values unchanged
+    if list(removed_rows) == list(added_rows):
+        return
+
+    config = DATASETS[dataset]
+    scheme = get_depth_scheme(site_id)
+    treatment_ids = site_treatment_ids(site_id, dataset)
+
+    changed = Measurements(list(removed_rows) + list(added_rows), config['analytes'], config['by_element'])
+    groups = {
+        (s.time_label, s.treatment_id, s.element, s.depth_bin, s.raw)
+        for s in depth_bin_means(changed, scheme, treatment_ids)
+    }
+    if not groups:
+        return
+
+    group_filter = Q()
+    for time_label, treatment_id, element, depth_bin, raw in groups:
+        group_filter |= Q(
+            time_label=time_label,
+            treatment_id=treatment_id,
+            element=element,
+            depth_bin=depth_bin,
+            raw=raw,
+        )
+
+    with transaction.atomic():
+        lock_site(site_id)
+
+        site_summaries = DepthSummary.objects.filter(site_id=site_id, dataset=dataset)
+        summaries = {
+            (s.time_label, s.treatment_id, s.element, s.depth_bin, s.raw, s.analyte): s
+            for s in site_summaries.filter(group_filter, analyte__in=config['analytes'])
+        }
+
+        if not summaries and not site_summaries.exists():
+            # summaries were never computed for the site
+            schedule_summary_refresh(site_id, [dataset])
+            return
+
+        measurements = Measurements.load(
+            config['model'].objects.filter(site=site_id, time_label__in={group[0] for group in groups}),
+            config['analytes'],
+            by_element=config['by_element'],
+        )
+
+        to_update = []
+        to_create = []
+
+        for computed in depth_bin_means(measurements, scheme, treatment_ids):
+            key = (computed.time_label, computed.treatment_id, computed.element, computed.depth_bin, computed.raw)
+            if key not in groups:
+                continue
+
+            summary = summaries.pop(key + (computed.analyte,), None)
+
+            if summary is None:
+                to_create.append(DepthSummary(site_id=site_id, dataset=dataset, **computed._asdict()))
+            elif (summary.n, summary.samples, summary.total, summary.mean) != (
+                computed.n, computed.samples, computed.total, computed.mean
+            ):
+                summary.n = computed.n
+                summary.samples = computed.samples
+                summary.total = computed.total
+                summary.mean = computed.mean
+                to_update.append(summary)
+
+        DepthSummary.objects.bulk_update(to_update, ['n', 'samples', 'total', 'mean'])
+        DepthSummary.objects.bulk_create(to_create)
+        # bins left without samples are left out, as in a full refresh
+        DepthSummary.objects.filter(pk__in=[summary.pk for summary in summaries.values()]).delete()
+
+    invalidate_site_on_commit(site_id)
+
+
+# site datasets to refresh once the current transaction commits, by thread
+_pending = threading.local()
+
+
+def run_pending_summary_refreshes():
+    """
+    Refreshes the pending site datasets. The first call after a commit
+    refreshes them all and later calls find nothing left to do.
+    """
+
+    pending = getattr(_pending, 'datasets', {})
+    _pending.datasets = {}
+
+    for site_id, datasets in pending.items():
+        refresh_site_summaries(site_id, sorted(datasets))
+
+
+def schedule_summary_refresh(site_id, datasets=None):
+    """
+    Refreshes the summaries of a site when the current transaction commits,
+    or right away outside of a transaction. A bulk change refreshes each
+    site once instead of once per row.
+    """
+
+    datasets = datasets or list(DATASETS)
+
+    if not connection.in_atomic_block:
+        refresh_site_summaries(site_id, datasets)
+        return
+
+    if not hasattr(_pending, 'datasets'):
+        _pending.datasets = {}
+    _pending.datasets.setdefault(site_id, set()).update(datasets)
+
+    # sites left over from a rolled back transaction are refreshed with the
+    # next commit, which is harmless
+    transaction.on_commit(run_pending_summary_refreshes)
+
+
+def site_time_labels(site_id, datasets):
+    """
+    Returns the time points measured at a site, by dataset, with one query.
+    The responses list every time point, including those whose samples fall
+    in no summary bin.
+    """
+
+    queries = [
+        DATASETS[dataset]['model'].objects.filter(site=site_id).annotate(
+            summary_dataset=Value(dataset, output_field=CharField())
+        ).values_list('summary_dataset', 'time_label').order_by()
+        for dataset in datasets
+    ]
+
+    time_labels = {dataset: set() for dataset in datasets}
+    for dataset, time_label in queries[0].union(*queries[1:]):
+        time_labels[dataset].add(time_label)
+
+    return {dataset: sorted(labels) for dataset, labels in time_labels.items()}
+
+
+class SiteSummaries:
+    """
+    The summary rows of a site dataset, indexed for building a response.
+    """
+
+    def __init__(self, site_id, dataset, rows=None, time_labels=None):
+        if rows is None:
+            rows = DepthSummary.objects.filter(site_id=site_id, dataset=dataset).values_list(
+                'time_label', 'treatment_id', 'element', 'analyte', 'depth_bin', 'raw', 'mean'
+            )
+
+        if time_labels is None:
+            time_labels = site_time_labels(site_id, [dataset])[dataset]
+
+        self.means = {}
+
+        for time_label, treatment_id, element, analyte, depth_bin, raw, mean in rows:
+            self.means[(time_label, treatment_id, element, analyte, depth_bin, raw)] = mean
+
+        self.time_labels = time_labels
+
+    @classmethod
+    def for_datasets(cls, site_id, datasets):
+        """
+        Loads the summaries of several datasets of a site with two queries.
+        Returns them by dataset.
+        """
+
+        rows = {dataset: [] for dataset in datasets}
+
+        for dataset, *row in DepthSummary.objects.filter(site_id=site_id, dataset__in=datasets).values_list(
+            'dataset', 'time_label', 'treatment_id', 'element', 'analyte', 'depth_bin', 'raw', 'mean'
+        ):
+            rows[dataset].append(row)
+
+        time_labels = site_time_labels(site_id, datasets) if datasets else {}
+
+        return {dataset: cls(site_id, dataset, rows[dataset], time_labels[dataset]) for dataset in datasets}
+
+    def mean(self, time_label, treatment_id, analyte, depth_bin, element=''):
+        return self.means.get((time_label, treatment_id, element, analyte, depth_bin, False))
+
+    def raw(self, analyte, depth, element=''):
+        return self.means.get((0, None, element, analyte, depth, True))
@@ -0,0 +1,966 @@
+import gzip
+import json
+import os
+import random
+import socketserver
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.cache.backends.memcached import PyMemcacheCache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Avg
+from django.forms.models import inlineformset_factory
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from artemis.admin import DepthBinFormSet
+from artemis.cache import get_site_json, get_site_version, invalidate_site, set_site_data, site_version_key
+from artemis.api.api import GeochemistryFilter, GeochemistryPagination
+from artemis.api.http import brotli
+from artemis.binning import Measurements, depth_bin_means
+from artemis.depth_schemes import DepthSchemeIndex, depth_label, depths, depths_time0
+from artemis.models import (
+  DepthBin,
+  DepthScheme,
+  DepthSummary,
+  Extraction,
+  Geochemistry,
+  Mineralogy,
+  Plot,
+  Replicate,
+  Site,
+  Treatment,
+)
+from artemis.summaries import (
+  compute_site_summaries,
+  elements,
+  extraction_elements,
+  minerals,
+  refresh_site_summaries,
+  schedule_summary_refresh,
+  solvents,
+)
+
+
+class SiteCacheTestCase(TestCase):
+
+    def setUp(self):
+        # site ids are reused across tests, the cached payloads are not
+        cache.clear()
+
+
+class GeochemistryIndexTests(TestCase):
+    """
+    The composite geochemistry index serves the filtered geochemistry
+    endpoint.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # the site filter only accepts existing sites
+        cls.site = Site.objects.create(name='Test site')
+
+    def explain(self, queryset):
+
+        if connection.vendor == 'postgresql':
+            # the test tables are empty, where a sequential scan always wins
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        return queryset.explain()
+
+    def filtered_queryset(self, params):
+
+        queryset = Geochemistry.objects.order_by(GeochemistryPagination.ordering)
+        return GeochemistryFilter(params, queryset=queryset).qs
+
+    def test_site_time_depth_filter_uses_index(self):
+
+        plan = self.explain(self.filtered_queryset({
+            'site': self.site.id,
+            'time_label': 2,
+            'min_depth__gte': 20,
+        }))
+
+        self.assertIn('geochem_site_time_depth_idx', plan)
+
+
+class LoadSiteDataTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name='Test site')
+
+    def load(self, *lines):
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, f.name)
+
+        out = StringIO()
+        call_command('load_site_data', 'geochemistry', f.name, stdout=out)
+        return out.getvalue()
+
+    def test_key_columns_only(self):
+
+        lines = ['site,time_label,min_depth,max_depth', 'Test site,0,0,5']
+        self.assertIn('1 created, 0 updated', self.load(*lines))
+        self.assertIn('0 created, 1 updated', self.load(*lines))
+
+    def test_duplicate_rows_counted_once(self):
+
+        lines = ['site,time_label,min_depth,max_depth,pH', 'Test site,0,0,5,6.5', 'Test site,0,0,5,7.5']
+        self.assertIn('1 created, 0 updated', self.load(*lines))
+        self.assertIn('0 created, 1 updated', self.load(*lines))
+        self.assertEqual(list(Geochemistry.objects.values_list('pH', flat=True)), [7.5])
+
+
+class DepthBinMeansTests(SimpleTestCase):
+
+    scheme = DepthSchemeIndex(later=[[0, 20], [20, 40], [40, 60]], time0=[[0, 10], [10, 20]])
+
+    def means(self, rows, treatment_ids=(1, 2)):
+        # rows are (time_label, min_depth, max_depth, treatment, a, b)
+        summaries = depth_bin_means(Measurements(rows, ['a', 'b']), self.scheme, treatment_ids)
+        return {
+            (summary.time_label, summary.treatment_id, summary.depth_bin, summary.raw, summary.analyte): summary
+            for summary in summaries
+        }
+
+    def test_nulls_are_skipped(self):
+
+        means = self.means([
+            (1, 0, 20, 1, 1.0, None),
+            (1, 0, 20, 1, 3.0, None),
+            (1, 0, 20, 1, None, 4.0),
+        ])
+
+        a = means[(1, 1, '0-20', False, 'a')]
+        self.assertEqual((a.mean, a.n, a.total, a.samples), (2.0, 2, 4.0, 3))
+
+        b = means[(1, 1, '0-20', False, 'b')]
+        self.assertEqual((b.mean, b.n, b.total, b.samples), (4.0, 1, 4.0, 3))
+
+    def test_all_null_bin(self):
+
+        means = self.means([
+            (1, 20, 40, 2, None, None),
+            (1, 20, 40, 2, None, 5.0),
+        ])
+
+        a = means[(1, 2, '20-40', False, 'a')]
+        self.assertIsNone(a.mean)
+        self.assertEqual((a.n, a.total, a.samples), (0, 0.0, 2))
+
+    def test_time0(self):
+
+        means = self.means([
+            (0, 0, 10, None, 8.0, None),
+            (0, 10, 20, None, 2.0, None),
+        ])
+
+        # folded into the later bin without a treatment, and kept raw
+        self.assertEqual(means[(0, None, '0-20', False, 'a')].mean, 5.0)
+        self.assertEqual(means[(0, None, '0-10', True, 'a')].mean, 8.0)
+        self.assertIsNone(means[(0, None, '10-20', True, 'b')].mean)
+
+    def test_bin_boundaries(self):
+
+        means = self.means([
+            # overlapping two bins equally
+            (1, 10, 30, 1, 1.0, 1.0),
+            # a point sample at a boundary belongs to the bin starting there
+            (1, 20, 20, 1, 2.0, 2.0),
+            (1, 40, 40, 1, 3.0, 3.0),
+        ])
+
+        self.assertEqual(means[(1, 1, '0-20', False, 'a')].mean, 1.0)
+        self.assertEqual(means[(1, 1, '20-40', False, 'a')].mean, 2.0)
+        self.assertEqual(means[(1, 1, '40-60', False, 'a')].mean, 3.0)
+
+    def test_other_rows_left_out(self):
+
+        means = self.means([
+            (1, 0, 20, 3, 1.0, 1.0),
+            (1, 60, 80, 1, 1.0, 1.0),
+            (0, 180, 183, None, 1.0, 1.0),
+        ])
+
+        self.assertEqual(means, {})
+
+
+class DepthBinFormSetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.scheme = DepthScheme.objects.create(name='Test scheme')
+        cls.bins = [
+            DepthBin.objects.create(scheme=cls.scheme, kind='later', min_depth=0, max_depth=10),
+            DepthBin.objects.create(scheme=cls.scheme, kind='later', min_depth=10, max_depth=20),
+        ]
+
+    def formset(self, *bins):
+        FormSet = inlineformset_factory(
+            DepthScheme, DepthBin, formset=DepthBinFormSet, fields=['kind', 'min_depth', 'max_depth'], extra=0
+        )
+
+        data = {
+            'bins-TOTAL_FORMS': len(bins),
+            'bins-INITIAL_FORMS': len(self.bins),
+        }
+        for i, (kind, min_depth, max_depth) in enumerate(bins):
+            data.update({
+                'bins-{}-kind'.format(i): kind,
+                'bins-{}-min_depth'.format(i): min_depth,
+                'bins-{}-max_depth'.format(i): max_depth,
+                'bins-{}-scheme'.format(i): self.scheme.pk,
+            })
+            if i < len(self.bins):
+                data['bins-{}-id'.format(i)] = self.bins[i].pk
+
+        return FormSet(data, instance=self.scheme)
+
+    def test_new_bins_overlap(self):
+
+        formset = self.formset(('later', 0, 10), ('later', 10, 20), ('later', 30, 50), ('later', 40, 60))
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.non_form_errors(), ['The 30-50 and 40-60 bins overlap.'])
+
+    def test_kinds_may_overlap(self):
+
+        formset = self.formset(('later', 0, 10), ('later', 10, 20), ('time0', 5, 15))
+        self.assertTrue(formset.is_valid())
+
+    def test_move_bin_boundary(self):
+
+        formset = self.formset(('later', 0, 15), ('later', 15, 20))
+        self.assertTrue(formset.is_valid())
+
+
+class ScheduleSummaryRefreshTests(TransactionTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(name='Test site')
+        Geochemistry.objects.create(site=self.site, time_label=0, min_depth=0, max_depth=5, Fe=1.0)
+        DepthSummary.objects.all().delete()
+
+    def test_refreshes_on_commit(self):
+
+        with transaction.atomic():
+            schedule_summary_refresh(self.site.id, ['geochemistry'])
+            schedule_summary_refresh(self.site.id, ['geochemistry'])
+            self.assertFalse(DepthSummary.objects.exists())
+
+        self.assertTrue(DepthSummary.objects.filter(site=self.site, analyte='Fe').exists())
+
+    def test_rolled_back_refresh_runs_with_next_commit(self):
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                schedule_summary_refresh(self.site.id, ['geochemistry'])
+                raise ValueError
+
+        self.assertFalse(DepthSummary.objects.exists())
+
+        with transaction.atomic():
+            schedule_summary_refresh(self.site.id, ['mineralogy'])
+
+        self.assertTrue(DepthSummary.objects.filter(site=self.site, analyte='Fe').exists())
+
+
+class MeasurementSignalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name='Test site')
+        treatment = Treatment.objects.create(label=1, description='Control')
+
+        cls.plots = []
+        for label in [1, 2]:
+            plot = Plot.objects.create(site=cls.site, label=label, treatment=treatment)
+            replicate = Replicate.objects.create(plot=plot, label=1)
+            for min_depth in [0, 10, 20]:
+                Geochemistry.objects.create(
+                    site=cls.site, replicate=replicate, time_label=1,
+                    min_depth=min_depth, max_depth=min_depth + 10, Fe=label + min_depth,
+                )
+            cls.plots.append(plot)
+
+    def stored_summaries(self):
+        return sorted(
+            DepthSummary.objects.filter(site=self.site, dataset='geochemistry').values_list(
+                'time_label', 'treatment_id', 'analyte', 'depth_bin', 'raw', 'samples', 'mean'
+            )
+        )
+
+    def computed_summaries(self):
+        return sorted(
+            (s.time_label, s.treatment_id, s.analyte, s.depth_bin, s.raw, s.samples, s.mean)
+            for s in compute_site_summaries(self.site.id, 'geochemistry')
+        )
+
+    def test_cascading_delete_refreshes_summaries(self):
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(9):
+                self.plots[0].delete()
+
+        self.assertEqual(self.stored_summaries(), self.computed_summaries())
+
+    def test_updated_bins_are_recomputed(self):
+
+        refresh_site_summaries(self.site.id)
+        sample = Geochemistry.objects.get(replicate__plot=self.plots[0], min_depth=0)
+
+        # a running sum would keep the rounding error of the large value
+        for value in [1e17, sample.Fe]:
+            sample.Fe = value
+            sample.save()
+
+        self.assertEqual(self.stored_summaries(), self.computed_summaries())
+
+    def test_save_rolls_back_with_summary_update(self):
+
+        sample = Geochemistry.objects.first()
+        sample.Fe = 100.0
+
+        with mock.patch('artemis.signals.update_measurement_summaries', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                sample.save()
+
+        sample.refresh_from_db()
+        self.assertNotEqual(sample.Fe, 100.0)
+
+
+class SiteGeochemPointsTests(SiteCacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name='Test site')
+        Geochemistry.objects.create(site=cls.site, time_label=0, min_depth=0, max_depth=5, Fe=1.5, As=0.5)
+
+    def test_element_filter(self):
+
+        response = self.client.get('/site-geochem-points/{}/?elements=Fe,As&format=columnar'.format(self.site.id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['points']['element'], ['As', 'Fe'])
+        self.assertEqual(response.json()['points']['element_amount'], [0.5, 1.5])
+
+    def test_served_from_cache(self):
+
+        path = '/site-geochem-points/{}/'.format(self.site.id)
+        content = self.client.get(path).content
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(path).content, content)
+
+    @override_settings(SITE_CACHE_MAX_SIZE=10)
+    def test_large_payloads_not_cached(self):
+
+        path = '/site-geochem-points/{}/'.format(self.site.id)
+        self.client.get(path)
+
+        with self.assertNumQueries(1):
+            self.client.get(path)
+
+    def test_unknown_element(self):
+
+        response = self.client.get('/site-geochem-points/{}/?elements=Fe,Xx'.format(self.site.id))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'elements': 'Unknown elements: Xx'})
+
+
+class SiteDataViewTests(SiteCacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name='Test site')
+        treatment = Treatment.objects.create(label=1, description='Control')
+        Plot.objects.create(site=cls.site, label=1, treatment=treatment)
+        Geochemistry.objects.create(site=cls.site, time_label=0, min_depth=0, max_depth=5, Fe=1.5)
+        refresh_site_summaries(cls.site.id)
+
+    def setUp(self):
+        super().setUp()
+        self.path = '/site-geochemistry/{}/'.format(self.site.id)
+
+    def test_not_modified(self):
+
+        etag = self.client.get(self.path)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_changes_after_write(self):
+
+        etag = self.client.get(self.path)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Geochemistry.objects.create(site=self.site, time_label=0, min_depth=5, max_depth=15, Fe=2.5)
+
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_gzip(self):
+
+        content = self.client.get(self.path).content
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), content)
+
+        # the encodings are distinct representations of the same ETag
+        self.assertEqual(
+            self.client.get(self.path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+
+        content = self.client.get(self.path).content
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), content)
+
+    def test_errors_not_tagged(self):
+
+        response = self.client.get('/site-geochem-points/{}/?elements=Xx'.format(self.site.id))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+    async def test_async_errors_not_tagged(self):
+
+        response = await self.async_client.get('/site-geochem-points-async/{}/?elements=Xx'.format(self.site.id))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class SiteCacheTests(SiteCacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sites = [Site.objects.create(name='Site {}'.format(i)) for i in range(2)]
+        cls.sample = Geochemistry.objects.create(site=cls.sites[0], time_label=0, min_depth=0, max_depth=5, Fe=1.0)
+
+    def test_invalidates_on_commit(self):
+
+        versions = [get_site_version(site.id) for site in self.sites]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sample.Fe = 2.0
+            self.sample.save()
+            # readers still see the committed data until the change commits
+            self.assertEqual(get_site_version(self.sites[0].id), versions[0])
+
+        self.assertNotEqual(get_site_version(self.sites[0].id), versions[0])
+        self.assertEqual(get_site_version(self.sites[1].id), versions[1])
+
+    def test_moved_measurement_invalidates_both_sites(self):
+
+        versions = [get_site_version(site.id) for site in self.sites]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sample.site = self.sites[1]
+            self.sample.save()
+
+        self.assertNotEqual(get_site_version(self.sites[0].id), versions[0])
+        self.assertNotEqual(get_site_version(self.sites[1].id), versions[1])
+
+    def test_payload_computed_across_a_change_is_stale(self):
+
+        site_id = self.sites[0].id
+        version = get_site_version(site_id)
+        invalidate_site(site_id)
+        set_site_data('geochemistry', site_id, {'stale': True}, version)
+
+        content = get_site_json('geochemistry', site_id, lambda site_id: {'stale': False})
+        self.assertIn(b'false', gzip.decompress(content))
+
+
+class SiteMoveTests(SiteCacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sites = [Site.objects.create(name='Site {}'.format(i)) for i in range(2)]
+        treatments = [Treatment.objects.create(label=i, description='Treatment {}'.format(i)) for i in range(2)]
+
+        cls.plots = [
+            Plot.objects.create(site=site, label=1, treatment=treatment)
+            for site, treatment in zip(cls.sites, treatments)
+        ]
+        cls.replicates = [Replicate.objects.create(plot=plot, label=1) for plot in cls.plots]
+
+        for replicate in cls.replicates:
+            Geochemistry.objects.create(
+                site=replicate.plot.site, replicate=replicate, time_label=1, min_depth=0, max_depth=10, Fe=1.0
+            )
+
+    def assertChanged(self, path, move):
+
+        etag = self.client.get(path)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move()
+
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def assertSummariesCurrent(self, site):
+
+        for dataset in ['geochemistry', 'mineralogy', 'extractions']:
+            stored = DepthSummary.objects.filter(site=site, dataset=dataset).values_list(
+                'time_label', 'treatment_id', 'element', 'analyte', 'depth_bin', 'raw', 'samples'
+            )
+            computed = [
+                (s.time_label, s.treatment_id, s.element, s.analyte, s.depth_bin, s.raw, s.samples)
+                for s in compute_site_summaries(site.id, dataset)
+            ]
+            self.assertEqual(sorted(stored), sorted(computed))
+
+    def test_moved_replicate_changes_old_site(self):
+
+        def move():
+            replicate = self.replicates[0]
+            replicate.plot = self.plots[1]
+            replicate.save()
+
+        self.assertChanged('/site-replicates/{}/'.format(self.sites[0].id), move)
+        self.assertSummariesCurrent(self.sites[0])
+        self.assertSummariesCurrent(self.sites[1])
+
+    def test_replicate_coordinates_keep_summaries(self):
+
+        def move():
+            replicate = self.replicates[0]
+            replicate.latitude, replicate.longitude = 32.5, -110.5
+            replicate.save()
+
+        with mock.patch('artemis.signals.schedule_summary_refresh') as schedule_summary_refresh:
+            self.assertChanged('/site-replicates/{}/'.format(self.sites[0].id), move)
+
+        schedule_summary_refresh.assert_not_called()
+
+    def test_moved_plot_changes_old_site(self):
+
+        def move():
+            plot = self.plots[0]
+            plot.site = self.sites[1]
+            plot.save()
+
+        self.assertChanged('/site-geochemistry/{}/'.format(self.sites[0].id), move)
+        self.assertSummariesCurrent(self.sites[0])
+        self.assertSummariesCurrent(self.sites[1])
+
+
+class SiteTimeLabelTests(SiteCacheTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name='Test site')
+        treatment = Treatment.objects.create(label=1, description='Control')
+        Plot.objects.create(site=cls.site, label=1, treatment=treatment)
+
+        # a later time point without a replicate has no treatment to be
+        # averaged under, so it has no summary rows
+        Geochemistry.objects.create(site=cls.site, time_label=5, min_depth=0, max_depth=20, Fe=1.0)
+
+    def test_time_point_without_summaries(self):
+
+        response = self.client.get('/site-geochemistry/{}/'.format(self.site.id)).json()
+
+        self.assertEqual(list(response), ['5'])
+        self.assertIsNone(response['5']['Control']['Fe']['0-20'])
+
+
+class MemcachedHandler(socketserver.StreamRequestHandler):
+    """
+    The part of the memcached text protocol used by Django's cache.
+    """
+
+    def reply(self, args, response):
+        if b'noreply' not in args:
+            self.wfile.write(response)
+
+    def handle(self):
+        items = self.server.items
+
+        for line in self.rfile:
+            command, *args = line.split()
+
+            with self.server.lock:
+                if command == b'get':
+                    for key in args:
+                        if key in items:
+                            flags, value = items[key]
+                            self.wfile.write(b'VALUE %s %d %d\r\n%s\r\n' % (key, flags, len(value), value))
+                    self.wfile.write(b'END\r\n')
+
+                elif command in (b'set', b'add'):
+                    key, flags, exptime, length = args[:4]
+                    value = self.rfile.read(int(length) + 2)[:-2]
+                    if command == b'set' or key not in items:
+                        items[key] = (int(flags), value)
+                        self.reply(args, b'STORED\r\n')
+                    else:
+                        self.reply(args, b'NOT_STORED\r\n')
+
+                elif command == b'delete':
+                    found = items.pop(args[0], None) is not None
+                    self.reply(args, b'DELETED\r\n' if found else b'NOT_FOUND\r\n')
+
+                elif command == b'flush_all':
+                    items.clear()
+                    self.reply(args, b'OK\r\n')
+
+                else:
+                    self.wfile.write(b'ERROR\r\n')
+
+
+class SharedSiteCacheTests(TestCase):
+    """
+    The site cache on a shared memcached backend, served by an in-process
+    stand-in server. Two backend instances play two web hosts.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), MemcachedHandler)
+        cls.server.daemon_threads = True
+        cls.server.items = {}
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+        cls.location = '127.0.0.1:{}'.format(cls.server.server_address[1])
+        cls.cache_settings = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+                'LOCATION': cls.location,
+            }
+        })
+        cls.cache_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.other_host = PyMemcacheCache(self.location, {})
+        self.addCleanup(self.other_host.close)
+
+    def test_round_trip(self):
+
+        computed = []
+
+        def compute(site_id):
+            computed.append(site_id)
+            return {'site': site_id}
+
+        content = get_site_json('geochemistry', 1, compute)
+        self.assertEqual(get_site_json('geochemistry', 1, compute), content)
+        self.assertEqual(computed, [1])
+        self.assertEqual(gzip.decompress(content), b'{"site":1}')
+
+    def test_invalidation_reaches_other_hosts(self):
+
+        version = get_site_version(1)
+        self.assertEqual(self.other_host.get(site_version_key(1)), version)
+
+        invalidate_site(1)
+        self.assertNotEqual(self.other_host.get(site_version_key(1)), version)
+
+        # a payload computed before the invalidation is never served
+        set_site_data('geochemistry', 1, {'stale': True}, version)
+        content = get_site_json('geochemistry', 1, lambda site_id: {'stale': False})
+        self.assertEqual(gzip.decompress(content), b'{"stale":false}')
+
+
+# time 0 depths averaged into each later depth by the aggregate queries
+TIME0_DEPTH_MINS = {'0-20': [0, 5, 15], '20-40': [25, 35], '40-60': [38], '60-90': []}
+
+
+def aggregated_site_data(model, analytes, site_id):
+    """
+    The site averages as the per-bin aggregate queries computed them
+    before the summary table, with time points in ascending order.
+    """
+
+    measurements = model.objects.filter(site=site_id)
+    treatment_ids = Plot.objects.filter(site_id=site_id).values_list('treatment', flat=True).distinct()
+
+    response = {}
+
+    for time in sorted(set(measurements.values_list('time_label', flat=True))):
+        response[time] = {}
+
+        for treatment_id in treatment_ids:
+            treatment_name = Treatment.objects.get(id=treatment_id).description
+            response[time][treatment_name] = {}
+            response[time]['raw'] = {}
+
+            for analyte in analytes:
+                response[time][treatment_name][analyte] = {}
+
+                if time == 0:
+                    response[time]['raw'][analyte] = {
+                        depth_label(depth): getattr(measurements.get(min_depth=depth[0], time_label=0), analyte)
+                        for depth in depths_time0
+                    }
+
+                for depth in depths:
+                    if time == 0:
+                        rows = measurements.filter(time_label=0, min_depth__in=TIME0_DEPTH_MINS[depth_label(depth)])
+                    else:
+                        rows = measurements.filter(
+                            time_label=time, min_depth=depth[0], replicate__plot__treatment=treatment_id
+                        )
+                    response[time][treatment_name][analyte][depth_label(depth)] = rows.aggregate(
+                        value=Avg(analyte)
+                    )['value']
+
+    return response
+
+
+def aggregated_extraction_data(site_id):
+
+    measurements = Extraction.objects.filter(site=site_id)
+
+    response = {'raw': {}}
+
+    for time in sorted(set(measurements.values_list('time_label', flat=True))):
+        response[time] = {}
+
+        for element in extraction_elements:
+            response[time][element] = {}
+            response['raw'].setdefault(element, {})
+
+            for solvent in solvents:
+                response[time][element][solvent] = {}
+
+                if time == 0:
+                    response['raw'][element][solvent] = {
+                        depth_label(depth): getattr(
+                            measurements.get(min_depth=depth[0], time_label=0, element=element), solvent
+                        )
+                        for depth in depths_time0
+                    }
+
+                for depth in depths:
+                    if time == 0:
+                        rows = measurements.filter(time_label=0, min_depth__in=TIME0_DEPTH_MINS[depth_label(depth)])
+                    else:
+                        rows = measurements.filter(time_label=time, min_depth=depth[0])
+                    response[time][element][solvent][depth_label(depth)] = rows.filter(element=element).aggregate(
+                        value=Avg(solvent)
+                    )['value']
+
+    return response
+
+
+class SiteAveragesTests(SiteCacheTestCase):
+    """
+    The summary-backed site endpoints return what the aggregate queries
+    did, with a query count independent of the site's size.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.random = random.Random(1)
+        cls.site = Site.objects.create(name='Test site')
+
+        for label, description in enumerate(['Control', 'Lime']):
+            cls.add_treatment(label, description)
+
+        # time 0 is sampled once per depth, later time points per replicate
+        for depth in depths_time0:
+            cls.add_samples(None, 0, depth)
+
+        for time_label in [1, 2]:
+            for replicate in Replicate.objects.filter(plot__site=cls.site):
+                for depth in depths[:3] if time_label == 2 else depths:
+                    cls.add_samples(replicate, time_label, depth)
+
+        # later samples without a replicate have no treatment to be averaged under
+        cls.add_samples(None, 2, depths[0])
+        cls.add_samples(None, 3, depths[0])
+
+        refresh_site_summaries(cls.site.id)
+
+    @classmethod
+    def add_treatment(cls, label, description):
+
+        treatment = Treatment.objects.create(label=label, description=description)
+        plot = Plot.objects.create(site=cls.site, label=label, treatment=treatment)
+        for replicate_label in [1, 2]:
+            Replicate.objects.create(plot=plot, label=replicate_label)
+
+    @classmethod
+    def values(cls, analytes):
+        # some values are missing, and Au & pyrite are never measured
+        return {
+            analyte: None if analyte in ['Au', 'pyrite'] or cls.random.random() < 0.2 else cls.random.uniform(0, 100)
+            for analyte in analytes
+        }
+
+    @classmethod
+    def add_samples(cls, replicate, time_label, depth):
+
+        sample = dict(site=cls.site, replicate=replicate, time_label=time_label, min_depth=depth[0], max_depth=depth[1])
+
+        Geochemistry.objects.bulk_create([Geochemistry(**sample, **cls.values(elements))])
+        Mineralogy.objects.bulk_create([Mineralogy(**sample, **cls.values(minerals))])
+        Extraction.objects.bulk_create([
+            Extraction(element=element, **sample, **cls.values(solvents)) for element in extraction_elements
+        ])
+
+    def assertSameData(self, data, expected, path=()):
+
+        if isinstance(expected, dict):
+            self.assertEqual(list(data), list(expected), path)
+            for key, value in expected.items():
+                self.assertSameData(data[key], value, path + (key,))
+        elif isinstance(expected, float):
+            self.assertAlmostEqual(data, expected, places=9, msg=path)
+        else:
+            self.assertEqual(data, expected, path)
+
+    def assertSameResponse(self, path, expected):
+
+        response = self.client.get(path.format(self.site.id))
+
+        self.assertEqual(response.status_code, 200)
+        # time point keys become strings in JSON
+        self.assertSameData(response.json(), json.loads(json.dumps(expected)))
+
+    def test_geochemistry(self):
+
+        self.assertSameResponse('/site-geochemistry/{}/', aggregated_site_data(Geochemistry, elements, self.site.id))
+
+    def test_mineralogy(self):
+
+        self.assertSameResponse('/site-mineralogy/{}/', aggregated_site_data(Mineralogy, minerals, self.site.id))
+
+    def test_extractions(self):
+
+        self.assertSameResponse('/site-extractions/{}/', aggregated_extraction_data(self.site.id))
+
+    def assertQueryCounts(self):
+
+        # the depth scheme is loaded once per process
+        self.client.get('/site-extractions/{}/'.format(self.site.id))
+
+        for path, count in [
+            ('/site-geochemistry/{}/', 4),
+            ('/site-mineralogy/{}/', 4),
+            ('/site-extractions/{}/', 2),
+        ]:
+            with self.assertNumQueries(count):
+                self.client.get(path.format(self.site.id))
+
+    def test_query_count(self):
+
+        self.assertQueryCounts()
+
+        # more treatments & time points take no more queries
+        self.add_treatment(2, 'Compost')
+        for replicate in Replicate.objects.filter(plot__site=self.site):
+            for depth in depths:
+                self.add_samples(replicate, 4, depth)
+        refresh_site_summaries(self.site.id)
+
+        self.assertQueryCounts()
+
+
+class SpatialFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        locations = {
+            'Tucson': (32.22, -110.97),
+            'Phoenix': (33.45, -112.07),
+            'Fiji': (-17.71, 178.07),
+            'Samoa': (-13.76, -172.1),
+            'Equator': (3.0, 10.0),
+        }
+
+        treatment = Treatment.objects.create(label=1, description='Control')
+
+        for name, (latitude, longitude) in locations.items():
+            site = Site.objects.create(name=name, latitude=latitude, longitude=longitude)
+            plot = Plot.objects.create(site=site, label=1, treatment=treatment)
+            Replicate.objects.create(plot=plot, label=1, latitude=latitude, longitude=longitude)
+
+        Site.objects.create(name='Unlocated')
+
+    def get_sites(self, query):
+
+        response = self.client.get('/sites/?' + query)
+
+        self.assertEqual(response.status_code, 200)
+        return [site['name'] for site in response.json()]
+
+    def get_replicate_sites(self, query):
+
+        response = self.client.get('/replicates/?' + query)
+
+        self.assertEqual(response.status_code, 200)
+        return sorted(Plot.objects.get(id=replicate['plot']).site.name for replicate in response.json())
+
+    def test_bbox(self):
+
+        self.assertEqual(self.get_sites('bbox=-111.5,31.5,-110,33'), ['Tucson'])
+        self.assertEqual(self.get_replicate_sites('bbox=-113,31.5,-110,34'), ['Phoenix', 'Tucson'])
+
+    def test_bbox_across_antimeridian(self):
+
+        self.assertEqual(sorted(self.get_sites('bbox=175,-20,-170,-10')), ['Fiji', 'Samoa'])
+        self.assertEqual(self.get_replicate_sites('bbox=175,-20,-170,-10'), ['Fiji', 'Samoa'])
+
+    def test_radius(self):
+
+        # about 160 km apart, nearest first
+        self.assertEqual(self.get_sites('near=32.2,-110.9&radius=200'), ['Tucson', 'Phoenix'])
+        self.assertEqual(self.get_sites('near=33.4,-112&radius=200'), ['Phoenix', 'Tucson'])
+        self.assertEqual(self.get_sites('near=32.2,-110.9&radius=10'), ['Tucson'])
+        self.assertEqual(self.get_replicate_sites('near=-15.7,-175&radius=500'), ['Samoa'])
+
+    def test_radius_across_antimeridian(self):
+
+        self.assertEqual(self.get_sites('near=-16,-179&radius=1000'), ['Fiji', 'Samoa'])
+
+    def test_grid_index_fallback(self):
+
+        # a box spanning 64 grid rows is selected through the index, a
+        # taller one on coordinates only
+        for north, indexed in [(6.35, True), (6.45, False)]:
+            with CaptureQueriesContext(connection) as queries:
+                sites = self.get_sites('bbox=9,0.05,11,{}'.format(north))
+
+            self.assertEqual(sites, ['Equator'])
+            self.assertEqual('"grid_cell" BETWEEN' in queries[-1]['sql'], indexed)
+
+        self.assertEqual(len(self.get_sites('bbox=-180,-90,180,90')), 5)
+
+    def test_invalid(self):
+
+        for query in ['bbox=1,2,3', 'bbox=0,10,10,0', 'near=32,-110', 'near=32,-110&radius=0', 'near=x,y&radius=1']:
+            self.assertEqual(self.client.get('/sites/?' + query).status_code, 400, query)
@@ -33,14 +33,26 @@ from artemis.api.api import (
     SiteExtractionsCached,
     SiteReplicates,
     SiteGeochemPoints,
+    SiteDashboard,
+    SiteComparison,
+    MeasurementExport,
 )
 
 from artemis.api.calculator import (
     LatexCalculator,
-    SimpleCalculator
+    SimpleCalculator,
+    SimpleCalculatorBatch,
 )
 
+from artemis.api.async_site import (
+    site_extractions,
+    site_geochem_points,
+    site_geochemistry,
+    site_mineralogy,
+)
 from artemis.api.auth import *
+from artemis.api.http import async_site_data_view, compress_page, site_data_view
+from artemis.api.metrics import metrics
 
 # Routers provide an easy way of automatically determining the URL conf.
 router = routers.DefaultRouter()
@@ -58,24 +70,38 @@ urlpatterns = [
     path('', include(router.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 
-    re_path('^site-geochem-cache/(?P<site_id>.+)/$', SiteGeochemistryCached.as_view()),
-    re_path('^site-geochemistry/(?P<site_id>.+)/$', SiteGeochemistry.as_view()),
+    re_path('^site-geochem-cache/(?P<site_id>.+)/$', site_data_view(SiteGeochemistryCached.as_view(), 'geochemistry')),
+    re_path('^site-geochemistry/(?P<site_id>.+)/$', site_data_view(SiteGeochemistry.as_view(), 'geochemistry')),
     
-    re_path('^site-mineralogy/(?P<site_id>.+)/$', SiteMineralogy.as_view()),
-    re_path('^site-mineralogy-cache/(?P<site_id>.+)/$', SiteMineralogyCached.as_view()),
+    re_path('^site-mineralogy/(?P<site_id>.+)/$', site_data_view(SiteMineralogy.as_view(), 'mineralogy')),
+    re_path('^site-mineralogy-cache/(?P<site_id>.+)/$', site_data_view(SiteMineralogyCached.as_view(), 'mineralogy')),
+
+    re_path('^site-extractions/(?P<site_id>.+)/$', site_data_view(SiteExtractions.as_view(), 'extractions')),
+    re_path('^site-extractions-cache/(?P<site_id>.+)/$', site_data_view(SiteExtractionsCached.as_view(), 'extractions')),
+
+    re_path('^site-replicates/(?P<site_id>.+)/$', site_data_view(SiteReplicates.as_view(), 'replicates')),
+    re_path('^site-geochem-points/(?P<site_id>.+)/$', site_data_view(SiteGeochemPoints.as_view(), 'geochem-points')),
+    re_path('^site-dashboard/(?P<site_id>.+)/$', site_data_view(SiteDashboard.as_view(), 'dashboard')),
 
-    re_path('^site-extractions/(?P<site_id>.+)/$', SiteExtractions.as_view()),
-    re_path('^site-extractions-cache/(?P<site_id>.+)/$', SiteExtractionsCached.as_view()),
+    # async versions of the site routes, for ASGI deployments
+    re_path('^site-geochemistry-async/(?P<site_id>.+)/$', async_site_data_view(site_geochemistry, 'geochemistry')),
+    re_path('^site-mineralogy-async/(?P<site_id>.+)/$', async_site_data_view(site_mineralogy, 'mineralogy')),
+    re_path('^site-extractions-async/(?P<site_id>.+)/$', async_site_data_view(site_extractions, 'extractions')),
+    re_path('^site-geochem-points-async/(?P<site_id>.+)/$', async_site_data_view(site_geochem_points, 'geochem-points')),
 
-    re_path('^site-replicates/(?P<site_id>.+)/$', SiteReplicates.as_view()),
-    re_path('^site-geochem-points/(?P<site_id>.+)/$', SiteGeochemPoints.as_view()),
+    re_path('^site-comparison/(?P<dataset>geochemistry|mineralogy)/$', compress_page(SiteComparison.as_view())),
+
+    re_path('^export/(?P<dataset>geochemistry|mineralogy|extractions)/$', MeasurementExport.as_view()),
 
     re_path('^latex-calculator', LatexCalculator.as_view()),
+    re_path('^simple-calculator-batch', SimpleCalculatorBatch.as_view()),
     re_path('^simple-calculator', SimpleCalculator.as_view()),
 
     path('api/login/', app_login, name='app_login'),
     path('api/logout/', app_logout, name='app_logout'),
     path('api/keycloak/', keycloak, name='keycloak'),
     path('api/auth/', is_user_logged_in, name='is_user_logged_in'),
+
+    path('metrics/', metrics, name='metrics'),
 ]
 